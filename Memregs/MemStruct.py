@@ -1,58 +1,5 @@
-import uctypes, json
-
-class MemCache:
-    """
-    Class to manage saving and loading of memory cache to a JSON file
-    """
-    def __init__(self, fnm):
-        self.fnm = fnm
-        self.cache = {}
-        self.h = False  
-
-    def _ld(self):
-        try:
-            with open(self.fnm, 'r') as f:
-                if f.seek(0, 2):
-                    f.seek(0)
-                    self.cache = json.load(f)
-                    self.h = hash(str(self.cache))
-                    return
-        except OSError:
-            pass
-        self.cache = {}
-        self.h = hash(str(self.cache))
-
-    def get(self, nm, h):
-        self._ld() if not self.h else None
-        if nm in self.cache.keys():
-            if self.cache[nm]['ID'] == h:
-                self.cache[nm].pop('ID')
-                r = self.cache[nm]
-                del self.cache[nm]
-                return r
-            del self.cache[nm]
-        return False
-    
-    def push(self, name, value, id):
-        l = {}
-        value.update({'ID': id})
-        try:
-            with open(self.fnm, 'r') as f:
-                if f.seek(0, 2):
-                    f.seek(0)
-                    l = json.load(f)
-                    if name in l:
-                        del l[name]
-        except OSError:
-            pass
-
-        l.update({name:value})
-
-        with open(self.fnm, 'w') as f:
-                json.dump(l, f)
-
-        if name in self.cache.keys():
-            del self.cache[name]
+import uctypes
+from memregs import RegCache as MemCache, _fp # same indexed cache file as memregs
 
 '''
 args structure: (name, length, bin=False, uctype format = None)
@@ -74,11 +21,11 @@ class Reg:
         self.buf[:] = self.mem[self.memstart:self.memstart + self.span]
 
 class ucMemReg(Reg):
-    c = MemCache('ccache.json')
+    c = MemCache('ccache.bin')
     def __init__(self, name, mem, memstart, *args, span=32):
         super().__init__(name, mem, memstart, span)
         
-        self._id = hash(args + tuple([memstart, span]))
+        self._id = _fp(type(self).__name__, args, memstart, span)
         self.struct = {}
         self.layout = {}
         self.sav = self._from_cache()
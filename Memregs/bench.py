@@ -0,0 +1,234 @@
+"""
+Benchmarks for the memregs hot paths. It runs on your computer (CPython) with fake memories standing in for the
+microcontroller's, so you can compare two versions of memregs before flashing anything.
+
+Each result is printed as one JSON line:
+    {"bench": "pack_get_int", "backend": "bytearray", "ns": 512.3, "alloc": 56}
+`ns` is the time per operation, `alloc` the bytes allocated at the peak of one operation as seen by tracemalloc.
+Allocations are what hurts on micropython, so keep an eye on them even when the time looks fine.
+
+usage:
+    python bench.py [-n loops] [-k filter] > new.jsonl
+    python bench.py --compare old.jsonl new.jsonl
+"""
+import json, os, sys, tempfile, time, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'nrfutils'))
+import memregs, nrfutils
+
+class SlowNVS:
+    """ Fake NVS/flash partition: slices cost a fixed delay plus a delay per byte """
+    def __init__(self, sz, op_us=50, byte_us=1):
+        self.b = bytearray(sz)
+        self.op_us, self.byte_us = op_us, byte_us
+
+    def _wait(self, n):
+        t = time.perf_counter() + (self.op_us + self.byte_us * n) / 1e6
+        while time.perf_counter() < t:
+            pass
+
+    def __len__(self): return len(self.b)
+
+    def __getitem__(self, k):
+        r = self.b[k]
+        self._wait(len(r) if isinstance(k, slice) else 1)
+        return r
+
+    def __setitem__(self, k, v):
+        self.b[k] = v
+        self._wait(len(v) if isinstance(k, slice) else 1)
+
+class FakeMem32:
+    """ Fake machine.mem32: 32 bits words at aligned addresses, like on the microcontroller """
+    def __init__(self):
+        self.w = {}
+
+    def __getitem__(self, a):
+        if a & 3:
+            raise ValueError('address must be aligned')
+        return self.w.get(a, 0)
+
+    def __setitem__(self, a, v):
+        if a & 3:
+            raise ValueError('address must be aligned')
+        self.w[a] = v & 0xFFFFFFFF
+
+BACKENDS = {
+    'bytearray': lambda: bytearray(256),
+    'memoryview': lambda: memoryview(bytearray(256)),
+    'nvs': lambda: SlowNVS(256),
+    'sleepmem': lambda: nrfutils.SleepMemory(7, 1, FakeMem32()),
+}
+
+ITEMS = (('INITD', 1, True), ('MNT', 1, True), ('FLAG', 1, True), ('TYPE', 8), ('DATE', 1, False, 'I'),
+         ('TEMP', 1, False, 'h'), ('VOLT', 1, False, 'f'), ('READINGS', 8, False, 'H'))
+
+def _time(fn, n):
+    t = time.perf_counter_ns()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter_ns() - t) / n
+
+def _alloc(fn):
+    fn() # warm up, so caches don't count as allocations
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - base
+
+def _cache(path):
+    memregs.CACHE = memregs.RegCache(path)
+
+def benches(path):
+    """ Yields (bench, backend, fn, loops divider) """
+    def cold(cls):
+        def f():
+            os.remove(path) if os.path.exists(path) else None
+            _cache(path)
+            cls('REG', bytearray(64), 0, *ITEMS, span=64)
+        return f
+
+    def warm(cls):
+        _cache(path)
+        cls('REG', bytearray(64), 0, *ITEMS, span=64)
+        def f():
+            _cache(path)
+            cls('REG', bytearray(64), 0, *ITEMS, span=64)
+        return f
+
+    for cls in (memregs.Pack, memregs.OrderedPack):
+        nm = cls.__name__.lower()
+        yield nm + '_new_cold', 'bytearray', cold(cls), 20
+        yield nm + '_new_warm', 'bytearray', warm(cls), 20
+
+    class Reg(memregs.Register):
+        initd, mnt, flag = memregs.Bit(), memregs.Bit(), memregs.Bit()
+        date = memregs.U32()
+        temp = memregs.I16()
+    rr = Reg('REG', bytearray(64), 16)
+    yield 'register_get_int', 'bytearray', lambda: rr.date, 1
+    yield 'register_set_int', 'bytearray', lambda: setattr(rr, 'date', 12345), 1
+    yield 'register_get_bit', 'bytearray', lambda: rr.flag, 1
+    yield 'register_set_bit', 'bytearray', lambda: setattr(rr, 'flag', 1), 1
+
+    _cache(path)
+    rg = memregs.Pack('RING', bytearray(256), 0, ('HIST', 100, False, 'RING:H'), span=256)['HIST']
+    for i in range(100):
+        rg.push(i)
+    yield 'ring_push', 'bytearray', lambda: rg.push(1234), 1
+    yield 'ring_iter', 'bytearray', lambda: sum(rg), 20
+
+    for be, mk in BACKENDS.items():
+        for cls in (memregs.Pack, memregs.OrderedPack):
+            nm = cls.__name__.lower()
+            _cache(path)
+            p = cls('REG', mk(), 16, *ITEMS, span=64)
+            d, f, b, r = p['DATE'], p['FLAG'], p['TYPE'], p['READINGS']
+            if be == 'bytearray':
+                yield nm + '_get_int', be, lambda d=d: d.value, 1
+                yield nm + '_set_int', be, lambda d=d: d.ch_val(12345), 1
+                yield nm + '_get_bit', be, lambda f=f: f.value, 1
+                yield nm + '_set_bit', be, lambda f=f: f.ch_val(1), 1
+                yield nm + '_toggle', be, f.toggle, 1
+                yield nm + '_set_flags', be, lambda p=p: p.set_flags(INITD=1, MNT=0, FLAG=1), 1
+                yield nm + '_get_bytes', be, lambda b=b: b.value, 1
+                yield nm + '_set_bytes', be, lambda b=b: b.ch_val(b'abc'), 1
+                yield nm + '_get_array', be, lambda r=r: r.value, 1
+                yield nm + '_setitem', be, lambda p=p: p.__setitem__('TEMP', -5), 1
+                yield nm + '_lookup_get_int', be, lambda p=p: p['DATE'].value, 1
+                yield nm + '_lookup_set_bit', be, lambda p=p: p.__setitem__('FLAG', 1), 1
+                yield nm + '_snapshot', be, p.snapshot, 1
+                vals = p.snapshot()
+                yield nm + '_update', be, lambda p=p, v=vals: p.update(**v), 1
+            div = 50 if be == 'nvs' else 1
+            yield nm + '_post_bit', be, lambda p=p, f=f: (f.toggle(), p.post_all()), div
+            yield nm + '_post_all', be, lambda p=p: (p.touch(), p.post_all()), div
+            yield nm + '_ld_buf', be, p.ld_buf, div
+
+    # irq mode: alloc must stay 0. Values are kept under 256 so CPython's ints are cached, like micropython's small ints
+    _cache(path)
+    ip = memregs.Pack('IRQ', bytearray(128), 16, *ITEMS, span=64, irq=True)
+    d, f = ip['DATE'], ip['FLAG']
+    yield 'pack_irq_get_int', 'bytearray', lambda: d.value, 1
+    yield 'pack_irq_set_int', 'bytearray', lambda: d.ch_val(123), 1
+    yield 'pack_irq_get_bit', 'bytearray', lambda: f.value, 1
+    yield 'pack_irq_set_bit', 'bytearray', lambda: f.ch_val(1), 1
+    yield 'pack_irq_toggle', 'bytearray', f.toggle, 1
+    yield 'pack_irq_post_bit', 'bytearray', lambda: (f.toggle(), ip.post_all()), 1
+    yield 'pack_irq_ld_buf', 'bytearray', ip.ld_buf, 1
+
+    _cache(path)
+    cp = memregs.Pack('CHK', bytearray(512), 0, *ITEMS, span=256, check=16)
+    cf = cp['FLAG']
+    yield 'pack_check_post_bit', 'bytearray', lambda: (cf.toggle(), cp.post_all()), 1
+    yield 'pack_check_ld_buf', 'bytearray', cp.ld_buf, 1
+
+    rf = memregs.RegisterFile('PERIPH', 0x40000000, *(('R%d' % i, i * 4, 'rw', ('EN', 0, 1), ('MODE', 1, 3))
+                                                       for i in range(30)), mem=FakeMem32())
+    def reconf(rf=rf):
+        rf['R3.EN'], rf['R10.MODE'], rf['R22'] = 1, 5, 0x1234
+        rf.post_all()
+    yield 'regfile_reconf', 'mem32', reconf, 1
+    yield 'regfile_reload', 'mem32', lambda rf=rf: (rf.ld_buf(), rf['R3.MODE'], rf['R10.EN']), 1
+
+    if hasattr(memregs, 'Struct'):
+        sitems = (('INITD', 1, True), ('MNT', 1, True), ('TYPE', 8, 'ARRAY'), ('DATE', 1, 'UINT32'), ('TEMP', 1, 'INT16'))
+        for be, mk in BACKENDS.items():
+            _cache(path)
+            s = memregs.Struct('SREG', mk(), 16, *sitems, span=32)
+            if be == 'bytearray':
+                yield 'struct_get_int', be, lambda s=s: s['DATE'], 1
+                yield 'struct_set_int', be, lambda s=s: s.__setitem__('DATE', 12345), 1
+                yield 'struct_toggle', be, lambda s=s: s.toggle('MNT'), 1
+                yield 'struct_set_bytes', be, lambda s=s: s.__setitem__('TYPE', b'abc'), 1
+            div = 50 if be == 'nvs' else 1
+            yield 'struct_post_all', be, lambda s=s: (s.touch(), s.post_all()), div
+            yield 'struct_ld_buf', be, s.ld_buf, div
+
+def run(n, flt=None):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'memcache.bin')
+        cache = memregs.CACHE
+        try:
+            for nm, be, fn, div in benches(path):
+                if flt and flt not in nm:
+                    continue
+                ns = _time(fn, max(1, n // div))
+                print(json.dumps({'bench': nm, 'backend': be, 'ns': round(ns, 1), 'alloc': _alloc(fn)}), flush=True)
+        finally:
+            memregs.CACHE = cache
+
+def _load(fnm):
+    with open(fnm) as f:
+        return {(r['bench'], r['backend']): r for r in map(json.loads, filter(None, map(str.strip, f)))}
+
+def compare(old, new):
+    a, b = _load(old), _load(new)
+    print(f"{'bench':<28}{'backend':<12}{'old ns':>12}{'new ns':>12}{'ratio':>8}{'old B':>8}{'new B':>8}")
+    for k in sorted(a.keys() & b.keys()):
+        o, n = a[k], b[k]
+        print(f"{k[0]:<28}{k[1]:<12}{o['ns']:>12}{n['ns']:>12}{n['ns'] / o['ns']:>8.2f}{o['alloc']:>8}{n['alloc']:>8}")
+
+def main(argv):
+    if argv[1:2] == ['--compare']:
+        compare(argv[2], argv[3])
+        return 0
+    n, flt = 20000, None
+    it = iter(argv[1:])
+    for a in it:
+        if a == '-n':
+            n = int(next(it))
+        elif a == '-k':
+            flt = next(it)
+        else:
+            print(__doc__)
+            return 1
+    run(n, flt)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
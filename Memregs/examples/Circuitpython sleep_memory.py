@@ -11,18 +11,17 @@ led.value = True
 
 # Items structure ('NAME', len, bin = False, format = 'B') The format is the same struct formats
 values = memregs.Pack('values', sm, 0, ('REFRESH', 1), ('MAGIC', 4), ('FLAG', 1, True),
-                        ('INIT_TIME', 1, False,'L'), ('READINGS', 5), span=16)
+                        ('INIT_TIME', 1, False,'L'), ('READINGS', 5, False, 'RING'), span=24, check=8)
+# check=8: a checksum for every 8 bytes is kept right after the register, so sleep_memory[24:30] is used too
 
 def pretend_sensor_readings_FIFO(ar):
-    tmp = bytearray(ar.value[1:])
-    tmp.append(os.urandom(1)[0])
+    ar.push(os.urandom(1)[0])
     # Let's say this would be a sensor reading, so that your device remembers the last 5
-    ar.value = tmp
     values.post_all()
 
 time_alarm = alarm.time.TimeAlarm(monotonic_time=time.monotonic() + 2)
 
-if values['MAGIC'] != b'CAFE':
+if not values.valid or values['MAGIC'] != b'CAFE': # valid is False if a brown-out damaged the memory
     values['INIT_TIME'].value = time.time()
     values['MAGIC'] = b'CAFE'
     values.post_all()
@@ -31,7 +30,7 @@ print(f"sleep_memory: {sm[:32]}")
 pretend_sensor_readings_FIFO(values['READINGS'])
 
 st = ''
-for b in values['READINGS'].value:
+for b in values['READINGS']:
     st += '.'*(b//51+1)
     st += '\n'
 
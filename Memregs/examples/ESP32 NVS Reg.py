@@ -10,8 +10,12 @@ class NVSreg(memregs.Struct):
     nvs = esp32.NVS('reg')
 
     def post_all(self):
+        if not self.dirty:
+            # Nothing changed, no need to wear the flash
+            return
         NVSreg.nvs.set_blob(self.name, self.buf)
         NVSreg.nvs.commit()
+        self.written += self.span
         self.ld_buf()
 
     def ld_buf(self):
@@ -20,6 +24,7 @@ class NVSreg(memregs.Struct):
         except OSError:
             # If the memory doesn't already exist, just use the empty buffer
             pass
+        self._clean()
 
 config = NVSreg('config', bytearray(32), 0, ('favorite color', 10, 'ARRAY'), ('LANGUAGE', 2, 'ARRAY'),
                 ('INIT_DATE', 1, 'UINT32'), ('PLATFORM', 6, 'ARRAY'), ('INITED', 1, True))
@@ -43,20 +43,18 @@ def flag_toggle(button):
     # a device running on batteries, and you want to use a button.
 
 def pretend_sensor_readings_FIFO(ar):
-    tmp = ar[1:]
-    tmp.append(os.urandom(1)[0]) # Let's say this would be a sensor reading, so that your device remembers the last 5
-    ar[:] = tmp
+    ar.push(os.urandom(1)[0]) # Let's say this would be a sensor reading, so that your device remembers the last 5
 
 # That way, if you rename this file "main.py", you should be able to stop it from looping by pressing the boot button
 boot.irq(flag_toggle, machine.Pin.IRQ_FALLING)
 
-rtc = RTCWrapper(16)
+rtc = RTCWrapper(30) # 24 bytes for the register, 6 for its checksums
 
 # Items structure ('NAME', len, bin = False, format = 'UINT8') The format is the same as uctypes formats
 values = memregs.Struct('values', rtc, 0, ('REFRESH', 1), ('MAGIC', 4, 'ARRAY'), ('FLAG', 1, True),
-                        ('INIT_TIME', 1, 'UINT16'), ('READINGS', 5, 'ARRAY'), span=16)
+                        ('INIT_TIME', 1, 'UINT16'), ('READINGS', 5, 'RING'), span=24, check=8)
 
-if values['MAGIC'] != b'CAFE':
+if not values.valid or values['MAGIC'] != b'CAFE': # valid is False if a brown-out damaged the memory
     values['INIT_TIME'] = time.time()
     values['MAGIC'] = b'CAFE'
 
@@ -0,0 +1,133 @@
+"""
+Pure python stand-in for micropython's uctypes, so the Struct classes of memregs run on your computer (CPython) for
+tests, benchmarks and memcompile.py. memregs imports it by itself on CPython, don't use it on the microcontroller.
+
+Only what memregs needs is there: scalar, bit field and array fields. There are no real addresses in python, so
+addressof() gives each buffer a fake one and struct() finds the buffer back from it. mem8, mem16 and mem32 read and
+write these fake addresses, like machine's for IndexBinStruct.
+"""
+import struct as _st
+
+def _ty(x, bits):
+    # type constants are made like micropython does, they can be negative
+    x = (x << (32 - bits)) & 0xFFFFFFFF
+    return (x - (1 << 32) if x & 0x80000000 else x) >> 1
+
+(UINT8, INT8, UINT16, INT16, UINT32, INT32, UINT64, INT64,
+ BFUINT8, BFINT8, BFUINT16, BFINT16, BFUINT32, BFINT32, FLOAT32, FLOAT64) = (_ty(i, 4) for i in range(16))
+PTR, ARRAY = _ty(1, 2), _ty(2, 2)
+VOID = UINT8
+BF_POS, BF_LEN = 17, 22
+LITTLE_ENDIAN, BIG_ENDIAN, NATIVE = 0, 1, 2
+
+_FMT = 'BbHhIiQqBbHhIifd' # struct format of each type, bit fields are read with the format of their word
+_mem = {} # fake address: buffer, buffers are kept alive so their address stays theirs
+_ids = {}
+_nxt = 0x20000000
+
+def addressof(obj):
+    global _nxt
+    a = _ids.get(id(obj))
+    if a is None:
+        a = _ids[id(obj)] = _nxt
+        _mem[a] = obj
+        _nxt += (len(memoryview(obj).cast('B')) + 0xFFFF) & ~0xFFFF or 0x10000
+    return a
+
+def _find(addr):
+    for a, b in _mem.items():
+        if a <= addr < a + max(len(memoryview(b).cast('B')), 1):
+            return b, addr - a
+    raise ValueError('unknown address %x' % addr)
+
+def bytearray_at(addr, n):
+    b, o = _find(addr)
+    return memoryview(b).cast('B')[o:o + n]
+
+def bytes_at(addr, n):
+    return bytes(bytearray_at(addr, n))
+
+def _sz(t):
+    return _st.calcsize('<' + _FMT[t])
+
+def sizeof(layout, layout_type=NATIVE):
+    n = 0
+    for v in layout.values():
+        if type(v) is tuple:
+            n = max(n, (v[0] & 0x1FFFF) + (v[1] & 0xFFFF) * _sz((v[1] >> 27) & 0xF))
+        else:
+            n = max(n, (v & 0x1FFFF) + _sz((v >> 27) & 0xF))
+    return n
+
+class _Array:
+    # array of non byte elements
+    def __init__(self, b, o, n, fmt):
+        self._b, self._o, self._n, self._f = b, o, n, fmt
+        self._s = _st.calcsize(fmt)
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        return _st.unpack_from(self._f, self._b, self._o + i * self._s)[0]
+
+    def __setitem__(self, i, v):
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        _st.pack_into(self._f, self._b, self._o + i * self._s, v)
+
+class struct:
+    def __init__(self, addr, layout, layout_type=NATIVE):
+        b, o = _find(addr)
+        d = self.__dict__
+        d['_b'], d['_o'], d['_l'] = memoryview(b).cast('B'), o, layout
+        d['_e'] = '>' if layout_type == BIG_ENDIAN else '<'
+
+    def _fld(self, k):
+        try:
+            v = self._l[k]
+        except KeyError:
+            raise AttributeError(k)
+        if type(v) is tuple:
+            return v, self._o + (v[0] & 0x1FFFF), (v[1] >> 27) & 0xF
+        return v, self._o + (v & 0x1FFFF), (v >> 27) & 0xF
+
+    def __getattr__(self, k):
+        v, o, t = self._fld(k)
+        if type(v) is tuple:
+            n = v[1] & 0xFFFF
+            return self._b[o:o + n] if t == 0 else _Array(self._b, o, n, self._e + _FMT[t])
+        x = _st.unpack_from(self._e + _FMT[t], self._b, o)[0]
+        if 8 <= t < 14: # bit field
+            ln = (v >> BF_LEN) & 0x1F
+            x = (x >> ((v >> BF_POS) & 0x1F)) & ((1 << ln) - 1)
+            if t & 1 and x >> (ln - 1):
+                x -= 1 << ln
+        return x
+
+    def __setattr__(self, k, x):
+        v, o, t = self._fld(k)
+        if type(v) is tuple:
+            raise TypeError('array fields are changed by index')
+        f = self._e + _FMT[t]
+        if 8 <= t < 14:
+            p, m = (v >> BF_POS) & 0x1F, (1 << ((v >> BF_LEN) & 0x1F)) - 1
+            x = _st.unpack_from(f, self._b, o)[0] & ~(m << p) | (x & m) << p
+        _st.pack_into(f, self._b, o, x)
+
+class _MemN:
+    # machine.mem8/16/32 on the fake addresses
+    def __init__(self, fmt):
+        self._f = fmt
+
+    def __getitem__(self, a):
+        b, o = _find(a)
+        return _st.unpack_from(self._f, memoryview(b).cast('B'), o)[0]
+
+    def __setitem__(self, a, v):
+        b, o = _find(a)
+        _st.pack_into(self._f, memoryview(b).cast('B'), o, v & ((1 << (8 * _st.calcsize(self._f))) - 1))
+
+mem8, mem16, mem32 = _MemN('<B'), _MemN('<H'), _MemN('<I')
@@ -0,0 +1,135 @@
+"""
+Write-behind for memregs registers living in slow memories (NVS, flash, files), for uasyncio programs.
+
+post_all() on an NVS or flash memory blocks for milliseconds, and your other tasks with it. Registers added to a
+WriteBehind don't write in post_all() anymore, they only wait to be written. A background task writes them once no
+post_all() came for delay ms (or limit ms after the first one, if they never stop), so a burst of changes costs a single
+write. Registers sharing a memory are written together, with as few writes as possible.
+
+    import memregs, memasync
+    wb = memasync.WriteBehind(delay=200)
+    config = wb.add(memregs.Pack('CONFIG', nvs, 0, ('COUNT', 1, False, 'I'), span=16))
+    config['COUNT'] = 5
+    config.post_all()       # returns at once
+    await config.flush()    # written now
+    wb.sync()               # everything written, before machine.deepsleep()
+
+It works the same with CPython's asyncio, to try it with a fake slow memory on your computer.
+"""
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+import time
+import memregs
+
+_ms = getattr(time, 'ticks_ms', None) or (lambda: int(time.monotonic() * 1000))
+_sleep = getattr(asyncio, 'sleep_ms', None) or (lambda ms: asyncio.sleep(ms / 1000))
+
+def _grouped(r):
+    # True if memregs._flush can write r with the other registers of its memory
+    return isinstance(r, memregs.Mem) and (type(r).post_all is memregs.Mem.post_all or
+                                          isinstance(r, memregs.RegisterBank))
+
+class WriteBehind:
+    """
+    Delays and merges the post_all() of registers.
+    delay: ms without any post_all() before writing
+    limit: ms after the first post_all() the write can't be delayed anymore
+    After add(reg), reg.post_all() only asks for a write, await reg.flush() writes it now and reg.ld_buf() writes its
+    changes before reading. writes counts the writes done, error is the last exception raised by a write.
+    """
+    def __init__(self, *regs, delay=100, limit=1000):
+        self.delay, self.limit = delay, limit
+        self.regs = []
+        self.writes = 0
+        self.error = None
+        self._due = [] # registers waiting to be written
+        self._t0 = self._t1 = 0 # first and last post_all() since the last write
+        self._ev = asyncio.Event()
+        self._task = None
+        for r in regs:
+            self.add(r)
+
+    def add(self, reg):
+        """ Returns reg, which now writes behind """
+        reg.post_all = lambda: self._post(reg)
+        reg.flush = lambda: self.flush(reg)
+        reg.ld_buf = lambda: self._load(reg)
+        self.regs.append(reg)
+        return reg
+
+    def remove(self, reg):
+        """ Writes reg's changes and gives it back its own post_all() """
+        self._write((reg,)) if reg in self._due else None
+        for k in ('post_all', 'flush', 'ld_buf'):
+            delattr(reg, k)
+        self.regs.remove(reg)
+
+    def _post(self, reg):
+        t = _ms()
+        if not self._due:
+            self._t0 = t
+        self._t1 = t
+        if reg not in self._due:
+            self._due.append(reg)
+        if self._task is None:
+            c = self._run()
+            try:
+                self._task = asyncio.create_task(c)
+            except RuntimeError: # no event loop running, nothing to write behind
+                c.close()
+                self.sync()
+                return
+        self._ev.set()
+
+    def _load(self, reg):
+        self._write((reg,)) if reg in self._due else None
+        type(reg).ld_buf(reg)
+
+    async def _run(self):
+        while True:
+            await self._ev.wait()
+            while True:
+                t = _ms()
+                w = min(self.delay - memregs._diff(t, self._t1), self.limit - memregs._diff(t, self._t0))
+                if w <= 0:
+                    break
+                await _sleep(w)
+            self._ev.clear()
+            try:
+                self.sync()
+            except Exception: # kept in error, the registers are tried again with the next post_all()
+                pass
+
+    def _write(self, regs):
+        self._due = [r for r in self._due if r not in regs]
+        try:
+            memregs._flush([r for r in regs if _grouped(r)])
+            for r in regs:
+                type(r).post_all(r) if not _grouped(r) else None
+        except Exception as e:
+            self.error = e
+            self._due.extend(r for r in regs if r not in self._due)
+            raise
+        self.writes += 1
+
+    def sync(self):
+        """ Writes every register waiting now, call it before machine.deepsleep() """
+        if self._due:
+            self._write(self._due)
+
+    async def flush(self, reg=None):
+        """ Writes reg (or every register) now if it is waiting, without waiting for the delay """
+        if reg is None:
+            self.sync()
+        elif reg in self._due:
+            self._write((reg,))
+        await asyncio.sleep(0)
+
+    def close(self):
+        """ Writes everything and stops the background task """
+        self.sync()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,73 @@
+"""
+Layout compiler for memregs. It runs on your computer (CPython), not on the microcontroller.
+
+It reads a spec file listing your registers with the same arguments you give to the memregs classes, and writes a python
+module holding their layouts. Freeze that module in your firmware or compile it with mpy-cross, then give the layouts to
+your registers: they skip parsing the arguments and the cache file completely.
+
+spec file:
+    REGS = (
+        # (class, name, span, *args)
+        ('Pack', 'HEADER', 16, ('INITD', 1, True), ('MNT', 1, True), ('DATE', 1, False, 'H')),
+        ('Struct', 'REGISTER', 8, ('START', 1, True), ('STATUS', 1, True)),
+    )
+
+usage:
+    python memcompile.py spec.py reg_layouts.py
+
+on the microcontroller:
+    import memregs, reg_layouts
+    header = memregs.Pack('HEADER', memory, 0, span=16, layout=reg_layouts.HEADER)
+"""
+import sys
+import memregs
+
+class _NoCache:
+    # Keeps the compiler from reading or writing the cache file
+    def get(self, nm, h): return False
+    def push(self, name, value, hsh): pass
+
+def layout(kind, name, span, *args):
+    """ Returns the layout memregs would make for this register """
+    cls = getattr(memregs, kind, None)
+    if cls is None:
+        raise ValueError(f"{kind} is not available, Struct classes need uctypes")
+    if issubclass(cls, memregs.Pack):
+        cache, memregs.CACHE = memregs.CACHE, _NoCache()
+        try:
+            return cls(name, bytearray(span), 0, *args, span=span)._layout()
+        finally:
+            memregs.CACHE = cache
+    # Struct classes only need _parse_args, their constructor wants real memory
+    r = cls.__new__(cls)
+    r.layout = {}
+    r.fmt = f"BFUINT{span}" # IndexBinStruct
+    r._parse_args(args)
+    return r.layout
+
+def ident(name):
+    r = ''.join(c if c.isalnum() else '_' for c in name).upper()
+    return '_' + r if r[:1].isdigit() else r
+
+def compile_regs(regs, src='spec'):
+    out = [f"# Generated by memcompile.py from {src}, do not edit.", '']
+    for kind, name, span, *args in regs:
+        out.append(f"# memregs.{kind}({name!r}, mem, offset, span={span}, layout={ident(name)})")
+        out.append(f"{ident(name)} = {layout(kind, name, span, *args)!r}")
+        out.append('')
+    return '\n'.join(out)
+
+def main(argv):
+    if len(argv) != 3:
+        print(__doc__)
+        return 1
+    spec = {}
+    with open(argv[1]) as f:
+        exec(f.read(), spec)
+    r = compile_regs(spec['REGS'], argv[1])
+    with open(argv[2], 'w') as f:
+        f.write(r)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
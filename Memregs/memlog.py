@@ -0,0 +1,169 @@
+"""
+Log structured memory for memregs registers kept in flash.
+
+Rewriting a whole blob in flash (or NVS) every time a value changes is slow and wears the flash out. LogMem keeps the
+current image of your registers in ram, and every write only appends a small record (offset, length, changed bytes) to
+a flash page. When the page is full, the next page of the ring is used and starts with a copy of the whole image, so the
+pages are erased one after the other instead of always the same one.
+
+It works with any block device using micropython's extended block protocol (readblocks/writeblocks with an offset and
+ioctl), like esp32.Partition. FileFlash is a fake one in a file, to try it on your computer.
+
+    import esp32, memregs, memlog
+    flash = memlog.LogMem(esp32.Partition.find(esp32.Partition.TYPE_DATA, label='regs')[0], 64)
+    config = memregs.Pack('CONFIG', flash, 0, ('INITD', 1, True), ('COUNT', 1, False, 'I'), span=64)
+    config['COUNT'] = config['COUNT'].value + 1
+    config.post_all()
+"""
+import struct
+
+_HDR = b'ML' # page header: magic then sequence number (I)
+_HSZ = 6
+_END = 0xFFFF # offset of an erased record
+
+class LogMem:
+    """
+    Memory of size bytes living in the blocks first to first + pages of dev.
+    Page: header, then records: offset (H), length (H), data. The first record of a page is the whole image.
+    """
+    def __init__(self, dev, size, first=0, pages=None):
+        self.dev = dev
+        self.bsz = dev.ioctl(5, 0)
+        self.first = first
+        self.pages = pages or dev.ioctl(4, 0) - first
+        if size + _HSZ + 4 > self.bsz:
+            raise ValueError('image must fit in one block')
+        if self.pages < 2:
+            raise ValueError('at least 2 blocks are needed')
+        self.size = size
+        self.img = bytearray(size)
+        self.page, self.pos, self.seq = 0, 0, 0
+        self._erased = -1 # page already erased ahead of time by maintain()
+        self._hd = bytearray(4)
+        self._mount()
+
+    def _mount(self):
+        # finds the newest page and replays its records
+        h, best = bytearray(_HSZ), None
+        for p in range(self.pages):
+            self.dev.readblocks(self.first + p, h, 0)
+            if h[:2] == _HDR:
+                sq = struct.unpack_from('<I', h, 2)[0]
+                if best is None or sq > self.seq:
+                    best, self.seq = p, sq
+        if best is None:
+            self.seq = 0
+            self._compact(0)
+            return
+        self.page = best
+        b = bytearray(self.bsz)
+        self.dev.readblocks(self.first + best, b, 0)
+        p = _HSZ
+        while p + 4 <= self.bsz:
+            o, n = struct.unpack_from('<HH', b, p)
+            if o == _END or o + n > self.size or p + 4 + n > self.bsz:
+                break
+            self.img[o:o + n] = b[p + 4:p + 4 + n]
+            p += 4 + n
+        self.pos = p
+        if any(c != 0xFF for c in memoryview(b)[p:]):
+            # a write was cut (power loss), the rest of the page can't be trusted anymore
+            self._compact((best + 1) % self.pages)
+
+    def _erase(self, page):
+        if self._erased != page:
+            self.dev.ioctl(6, self.first + page)
+        self._erased = -1
+
+    def _compact(self, page):
+        # starts a new page with the whole image
+        self._erase(page)
+        self.seq += 1
+        # header last, the page is only valid once the image is in
+        self.dev.writeblocks(self.first + page, struct.pack('<HH', 0, self.size) + self.img, _HSZ)
+        self.dev.writeblocks(self.first + page, _HDR + struct.pack('<I', self.seq), 0)
+        self.page, self.pos = page, _HSZ + 4 + self.size
+
+    def maintain(self):
+        """ Erases the next page ahead of time when the current one is almost full, call it when you have time """
+        nxt = (self.page + 1) % self.pages
+        if self._erased != nxt and self.pos > self.bsz * 3 // 4:
+            self.dev.ioctl(6, self.first + nxt)
+            self._erased = nxt
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, k):
+        return self.img[k]
+
+    def __setitem__(self, k, v):
+        if isinstance(k, slice):
+            a, b = k.start or 0, self.size if k.stop is None else k.stop
+        else:
+            a, b, v = k, k + 1, bytes((v,))
+        if b - a != len(v):
+            raise ValueError('slice and value must have the same length')
+        # only the bytes that really changed are logged
+        img, i, j = self.img, 0, b - a
+        while i < j and img[a + i] == v[i]:
+            i += 1
+        while j > i and img[a + j - 1] == v[j - 1]:
+            j -= 1
+        if i == j:
+            return
+        v, a, b = v[i:j], a + i, a + j
+        img[a:b] = v
+        if self.pos + 4 + b - a > self.bsz:
+            self._compact((self.page + 1) % self.pages)
+            return
+        # data first and header last, a record is only valid once its header is written
+        self.dev.writeblocks(self.first + self.page, v, self.pos + 4)
+        struct.pack_into('<HH', self._hd, 0, a, b - a)
+        self.dev.writeblocks(self.first + self.page, self._hd, self.pos)
+        self.pos += 4 + b - a
+
+class FileFlash:
+    """
+    Fake flash in a file, with micropython's extended block protocol. Like real flash, writes can only clear bits
+    until the block is erased. erases counts the erase cycles of every block.
+    """
+    def __init__(self, fnm, blocks, bsz=4096):
+        self.fnm, self.blocks, self.bsz = fnm, blocks, bsz
+        self.erases = [0] * blocks
+        try:
+            with open(fnm, 'rb') as f:
+                n = len(f.read())
+        except OSError:
+            n = 0
+        if n < blocks * bsz:
+            with open(fnm, 'ab') as f:
+                f.write(b'\xff' * (blocks * bsz - n))
+
+    def readblocks(self, n, buf, off=0):
+        with open(self.fnm, 'rb') as f:
+            f.seek(n * self.bsz + off)
+            buf[:] = f.read(len(buf))
+
+    def writeblocks(self, n, buf, off=None):
+        if off is None:
+            self.ioctl(6, n)
+            off = 0
+        old = bytearray(len(buf))
+        self.readblocks(n, old, off)
+        with open(self.fnm, 'r+b') as f:
+            f.seek(n * self.bsz + off)
+            f.write(bytes(a & b for a, b in zip(old, buf)))
+
+    def ioctl(self, op, arg):
+        if op == 4:
+            return self.blocks
+        if op == 5:
+            return self.bsz
+        if op == 6:
+            self.erases[arg] += 1
+            with open(self.fnm, 'r+b') as f:
+                f.seek(arg * self.bsz)
+                f.write(b'\xff' * self.bsz)
+            return 0
+        return 0
@@ -1,102 +1,628 @@
-import struct,sys
+import struct,sys,time
 
-cache_f = 'memcache.txt'
+cache_f = 'memcache.bin'
 
 class RegCache:
     """
-    manages saving and loading of memory cache to a JSON file
+    manages saving and loading of memory cache to a binary file.
+    The file is a magic number, the records (one layout each), then the index and a footer, so only the index is read
+    at boot and a layout is read from its own record when a register asks for it.
+    record: item count (H), then for each item: key length (B), key, value count (B), values (I)
+    index entry: name length (B), name, hash (I), record offset (I), record length (H)
+    footer: index offset (I), index length (H), b'IX'
+    New records are appended over the old index and followed by a new one.
     """
+    MAGIC = b'MRC2'
+
     def __init__(self, fnm):
         self.fnm = fnm
-        self.cache = None
+        self.ix = None # raw index, searched in place
+        self._end = 0 # end of the records, where the index starts
+        self._new = {} # name: (hash, record) not in the file yet
+        self._hold = False
 
     def _ld(self):
-        if self.cache is not None:
+        if self.ix is not None:
             return
+        self.ix, self._end = b'', 0
         try:
             with open(self.fnm, 'rb') as f:
-                s = f.read().decode()
-                self.cache = eval(s)
+                n = f.seek(0, 2)
+                f.seek(0)
+                if n < 12 or f.read(4) != self.MAGIC:
+                    return
+                f.seek(n - 8)
+                o, ln, m = struct.unpack('<IH2s', f.read(8))
+                if m != b'IX' or o + ln + 8 != n:
+                    return # cut write, start over
+                f.seek(o)
+                self.ix, self._end = f.read(ln), o
         except OSError:
-            self.cache = {}
+            pass
+
+    def _find(self, nm):
+        # (hash, offset, length) of the record for nm, or None
+        ix, p, n = self.ix, 0, len(nm)
+        while p < len(ix):
+            k = ix[p]
+            if k == n and ix[p + 1:p + 1 + k] == nm:
+                return struct.unpack_from('<IIH', ix, p + 1 + k)
+            p += 11 + k
+        return None
+
+    # values are kept as signed 32 bits words: uctypes constants can be negative, Pack masks its own back to unsigned
+    @staticmethod
+    def _rec(value):
+        r = bytearray(struct.pack('<H', len(value)))
+        for k, v in value.items():
+            k = k.encode()
+            v = v if type(v) is tuple else (v,)
+            r += struct.pack('<B', len(k)) + k + struct.pack('<B%di' % len(v), len(v), *((x & 0x7FFFFFFF) - (x & 0x80000000) for x in v))
+        return r
+
+    @staticmethod
+    def _dec(b):
+        mv, d, p = memoryview(b), {}, 2
+        for _ in range(struct.unpack_from('<H', b, 0)[0]):
+            n = b[p]
+            k = str(mv[p + 1:p + 1 + n], 'utf-8')
+            p += 1 + n
+            n = b[p]
+            v = struct.unpack_from('<%di' % n, b, p + 1)
+            d[k] = v[0] if n == 1 else v
+            p += 1 + 4 * n
+        return d
 
     def get(self, nm, h):
         self._ld()
-        if nm in self.cache and self.cache[nm]['*HSH'] == h:
-            r = self.cache[nm].copy()
-            r.pop('*HSH', None)
-            return r
+        h &= 0xFFFFFFFF
+        r = self._new.get(nm)
+        if r is None:
+            e = self._find(nm.encode())
+            if e and e[0] == h:
+                try:
+                    with open(self.fnm, 'rb') as f:
+                        f.seek(e[1])
+                        r = (h, f.read(e[2]))
+                except OSError:
+                    pass
+        if r and r[0] == h:
+            _cnt('*CACHE', 0) if _ST is not None else None
+            return self._dec(r[1])
+        _cnt('*CACHE', 1) if _ST is not None else None
         return False
 
     def push(self, name, value, hsh):
+        self._new[name] = (hsh & 0xFFFFFFFF, self._rec(value))
+        if not self._hold:
+            self.commit()
+
+    def hold(self):
+        """ Keeps new layouts in ram until commit() so they are all written at once """
+        self._hold = True
+
+    def commit(self):
+        self._hold = False
+        if not self._new:
+            return
         self._ld()
-        self.cache[name] = value.copy()
-        self.cache[name]['*HSH'] = hsh
-        with open(self.fnm, 'wb') as f:
-            f.write(repr(self.cache).encode())
+        new, self._new = self._new, {}
+        ix, old, live, p = bytearray(), [], 0, 0
+        while p < len(self.ix):
+            # keeps the entries that were not replaced
+            k = self.ix[p]
+            if str(self.ix[p + 1:p + 1 + k], 'utf-8') not in new:
+                old.append(self.ix[p:p + 11 + k])
+                live += struct.unpack_from('<H', self.ix, p + 9 + k)[0]
+            p += 11 + k
+        rs = bytearray()
+        if self._end > 2 * live + 256:
+            # mostly replaced records, rewrite the file with the live ones only
+            with open(self.fnm, 'rb') as f:
+                for e in old:
+                    k = e[0]
+                    o, ln = struct.unpack_from('<IH', e, 5 + k)
+                    f.seek(o)
+                    ix += e[:5 + k] + struct.pack('<IH', 4 + len(rs), ln)
+                    rs += f.read(ln)
+            base, mode = 0, 'wb'
+        else:
+            for e in old:
+                ix += e
+            base, mode = self._end, 'r+b' if self._end else 'wb'
+        if not base:
+            rs = self.MAGIC + rs
+        for nm, (h, r) in new.items():
+            nm = nm.encode()
+            ix += struct.pack('<B', len(nm)) + nm + struct.pack('<IIH', h, base + len(rs), len(r))
+            rs += r
+        with open(self.fnm, mode) as f:
+            f.seek(base)
+            f.write(rs + ix + struct.pack('<IH2s', base + len(rs), len(ix), b'IX'))
+        self.ix, self._end = bytes(ix), base + len(rs)
+
+    def __enter__(self):
+        self.hold()
+        return self
+
+    def __exit__(self, *exc):
+        self.commit()
 
 CACHE = RegCache(cache_f)
 
+_LV = 4 # version of the layout rules, change it when the way layouts are made changes so the old ones are dropped
+
+try:
+    from binascii import crc32 as _crc
+except ImportError:
+    def _crc(b, c=0):
+        c ^= 0xFFFFFFFF
+        for x in b:
+            c ^= x
+            for _ in range(8):
+                c = (c >> 1) ^ (0xEDB88320 & -(c & 1))
+        return c ^ 0xFFFFFFFF
+
+def _fp(cls, args, offset, span):
+    """
+        Fingerprint of a layout definition, used to find it in the cache. Unlike hash(), it is the same on every run,
+        port and interpreter: it is the crc32 of a plain encoding of the class name, items, offset and span.
+    """
+    b = bytearray(str(_LV).encode())
+    for v in (cls,) + tuple(args) + ((offset, span),):
+        for x in (v if type(v) is tuple else (v,)):
+            if type(x) is str:
+                b += b'|s' + x.encode()
+            elif type(x) is bool or x is None:
+                b += b'|b1' if x else b'|b0'
+            else:
+                b += b'|i' + str(x).encode()
+        b += b';'
+    return _crc(b) & 0xFFFFFFFF
+
 def clear_cache():
-    CACHE.cache = None
+    CACHE.ix = None
 
 def delete_cache():
     import os
     os.remove(cache_f)
+    CACHE.ix = None
+
+# Stats, off by default. When on, _ST holds a list of counters per register name (see _STF) and '*CACHE': [hits, misses]
+_ST = None
+_TM = None # timer, like time.ticks_us
+_HK = None # hook called with (register name, 'post_all' or 'ld_buf', time)
+_STF = ('reads', 'writes', 'post_all', 'ld_buf', 'bytes_out', 'bytes_in', 'post_time', 'ld_time')
+_diff = getattr(time, 'ticks_diff', lambda a, b: a - b)
+
+def enable_stats(timer=None, hook=None):
+    """
+    Starts counting reads, writes, post_all/ld_buf calls, bytes transferred and cache hits.
+    timer: function returning the time, like time.ticks_us, to time post_all and ld_buf
+    hook: function called with (register name, 'post_all' or 'ld_buf', time) after each of them, time is None without
+    a timer
+    """
+    global _ST, _TM, _HK
+    _ST = {'*CACHE': [0, 0]} if _ST is None else _ST
+    _TM, _HK = timer, hook
+
+def disable_stats():
+    global _ST, _TM, _HK
+    _ST = _TM = _HK = None
+
+def stats(reset=False):
+    """ Returns the counters of every register as a dict {name: {counter: value}} """
+    global _ST
+    if _ST is None:
+        return {}
+    r = {nm: dict(zip(('hits', 'misses') if nm == '*CACHE' else _STF, c)) for nm, c in _ST.items()}
+    if reset:
+        _ST = {'*CACHE': [0, 0]}
+    return r
+
+def _cnt(nm, i, n=1):
+    c = _ST.get(nm)
+    if c is None:
+        c = _ST[nm] = [0] * 8
+    c[i] += n
+
+def _done(reg, op, n, t0):
+    # counts a post_all (op = 0) or ld_buf (op = 1) of n bytes which started at t0
+    _cnt(reg.name, 2 + op)
+    _cnt(reg.name, 4 + op, n)
+    dt = None
+    if _TM:
+        dt = _diff(_TM(), t0)
+        _cnt(reg.name, 6 + op, dt)
+    _HK(reg.name, ('post_all', 'ld_buf')[op], dt) if _HK else None
+
+def mapmem(fnm, size=0):
+    """
+    Maps a file as a memory for your registers, to work on big register images on your computer without reading them.
+    The file is made or grown to size bytes if needed. Use it with direct=True to skip the buffers entirely.
+    """
+    import mmap, os
+    with open(fnm, 'r+b' if os.path.exists(fnm) else 'w+b') as f:
+        if size and os.path.getsize(fnm) < size:
+            f.truncate(size)
+        return mmap.mmap(f.fileno(), size)
 
 class Mem:
     """
     Base class for memory-mapped registers that manages a memory buffer.
     This avoids breaking micropython when modifying memory directly.
+    In direct mode, buf is a view on mem itself: there is no copy, post_all and ld_buf have nothing to do.
+    In irq mode, post_all and ld_buf copy byte by byte and allocate nothing, so they can run in an interrupt handler.
+    seq is bumped by each change made to an irq register, readers retry when it changed during their read.
+    With check, a table of checksums (2 bytes per block of check bytes) is kept right after the register in mem. post_all
+    only updates the checksums of the blocks it wrote, ld_buf checks them all and sets valid.
     """
-    def __init__(self, name, mem, offset, span, auto_ld = True):
+    reload = False # set to True if something else than this register can change its memory
+    # defaults kept in the class, an instance only gets the ones it changes so small registers stay small
+    direct = irq = False
+    seq = check = 0
+    valid = None # result of the last check
+    _rd = None # mem.ld(start, buf) reads straight into buf, like nrfutils.SleepMemory's
+    _bk = None # RegisterBank holding this register
+
+    def __init__(self, name, mem, offset, span, auto_ld = True, buf = None, direct = False, irq = False, check = 0):
         self.name = name
         self.mem = mem
         self.memstart = offset
         self.span = span
-        self.buf = bytearray(span)
-        self.ld_buf() if auto_ld else None
+        if direct:
+            self.direct = True
+        if irq:
+            self.irq, self.seq = True, 0 # seq is made now, an interrupt handler mustn't grow the instance
+        if check:
+            self.check = check
+            if direct or irq:
+                raise ValueError('check needs a buffer and slices, not direct or irq mode')
+            self._ck = bytearray(2 * ((span + check - 1) // check))
+            self._ckall = True # every checksum is made again at the next post_all
+        if direct:
+            buf = memoryview(mem)[offset:offset + span]
+        self.buf = bytearray(span) if buf is None else buf # buf is given by RegisterBank
+        self.written = 0 # bytes written back to mem since creation
+        if hasattr(mem, 'ld'):
+            self._rd = mem.ld
+        self._dm = bytearray((span + 7) >> 3) # dirty map, one bit per byte of buf
+        self.ld_buf() if auto_ld and not direct else None
+
+    def _mark(self, a, b):
+        # Marks buf[a:b] as dirty, a byte of the map (8 bytes of buf) at a time, with small ints only
+        dm, i, j = self._dm, a >> 3, b >> 3
+        if i == j: # within one byte of the map, the usual case
+            if a < b:
+                dm[i] |= (0xFF >> (8 - b + a)) << (a & 7)
+            return
+        dm[i] |= 0xFF >> (a & 7) << (a & 7)
+        i += 1
+        while i < j:
+            dm[i] = 0xFF
+            i += 1
+        if b & 7:
+            dm[j] |= 0xFF >> (8 - (b & 7))
+
+    def touch(self):
+        """ Marks the whole buffer as dirty, use it after writing to buf directly """
+        self._mark(0, self.span)
+
+    def _runs(self):
+        # Yields the merged (start, end) dirty ranges of buf
+        dm, i, n = self._dm, 0, self.span
+        while i < n:
+            if not dm[i >> 3]:
+                i = (i | 7) + 1
+            elif dm[i >> 3] >> (i & 7) & 1:
+                j = i + 1
+                while j < n and dm[j >> 3] >> (j & 7) & 1:
+                    j += 1
+                yield i, j
+                i = j
+            else:
+                i += 1
+
+    def _clean(self):
+        dm = self._dm
+        for i in range(len(dm)):
+            dm[i] = 0
+
+    @property
+    def dirty(self):
+        return any(self._dm)
 
     def post_all(self):
-        # Dans le fond, c'est juste bon pour struct
-        # Pour pack, chaque item écrit dans mem directement
-        self.mem[self.memstart:self.memstart + self.span] = self.buf
-        self.ld_buf()
+        """ Writes back only the bytes that changed since the last post_all/ld_buf """
+        if self._bk is not None and self._bk.check: # the bank's checksums cover this register, the bank is written
+            return _flush((self,))
+        if self.direct:
+            return self._clean() # nothing to write, only what dirty says
+        if self.irq:
+            return self._irq_post()
+        t, n = _TM() if _TM else 0, self.written
+        mv = memoryview(self.buf)
+        rs = list(self._runs()) if self.check else self._runs()
+        for a, b in rs:
+            self.mem[self.memstart + a:self.memstart + b] = mv[a:b]
+            self.written += b - a
+        self._sum(rs) if self.check else None
+        self._clean()
+        _done(self, 0, self.written - n, t) if _ST is not None else None
+        self.ld_buf() if self.reload else None
 
     def ld_buf(self):
-        self.buf[:] = self.mem[self.memstart:self.memstart + self.span]
+        if self.direct:
+            return
+        if self.irq:
+            return self._irq_ld()
+        t = _TM() if _TM else 0
+        if self._rd:
+            self._rd(self.memstart, self.buf)
+        else:
+            self.buf[:] = self.mem[self.memstart:self.memstart + self.span]
+        self._clean()
+        self._verify() if self.check else None
+        _done(self, 1, self.span, t) if _ST is not None else None
+
+    def _sum(self, runs):
+        # updates the checksums of the blocks runs (sorted (start, end) in buf) touch, and writes them after the register
+        c, ck, mv, n = self.check, self._ck, memoryview(self.buf), self.span
+        if self._ckall:
+            runs, self._ckall = ((0, n),), False
+        lo = hi = 0 # blocks [lo, hi) were made again
+        for a, b in runs:
+            i = max(a // c, hi)
+            if i * c >= b:
+                continue
+            lo = i if lo == hi else lo
+            while i * c < b:
+                struct.pack_into('<H', ck, 2 * i, _crc(mv[i * c:min(i * c + c, n)], i) & 0xFFFF)
+                i += 1
+            hi = i
+        if lo < hi:
+            t = self.memstart + n
+            self.mem[t + 2 * lo:t + 2 * hi] = ck[2 * lo:2 * hi]
+
+    def _verify(self):
+        # checks every block against the table, a bad table is made again at the next post_all
+        c, ck, mv, n = self.check, self._ck, memoryview(self.buf), self.span
+        t = self.memstart + n
+        tb = self.mem[t:t + len(ck)]
+        ok, i = len(tb) == len(ck), 0
+        while ok and i * c < n:
+            ok = tb[2 * i] | tb[2 * i + 1] << 8 == _crc(mv[i * c:min(i * c + c, n)], i) & 0xFFFF
+            i += 1
+        if ok:
+            ck[:] = tb
+        self.valid = ok
+        self._ckall = not ok
+
+    def _irq_post(self):
+        # post_all without slices nor generators, written isn't counted
+        dm, b, m, o, n = self._dm, self.buf, self.mem, self.memstart, self.span
+        k = 0
+        while k < len(dm):
+            s, d = self.seq, dm[k]
+            if d:
+                dm[k] = 0
+                if self.seq != s: # an interrupt changed the register in between, its marks may be lost
+                    d = 0xFF
+                j = k << 3
+                while d and j < n:
+                    if d & 1:
+                        m[o + j] = b[j]
+                    d >>= 1
+                    j += 1
+            k += 1
+
+    def _irq_ld(self):
+        b, m, o, j = self.buf, self.mem, self.memstart, 0
+        while j < self.span:
+            b[j] = m[o + j]
+            j += 1
+        dm, k = self._dm, 0
+        while k < len(dm):
+            dm[k] = 0
+            k += 1
+
+class Ring:
+    """
+    Ring buffer of n samples in a register's buffer: head (H), fill (H), then the slots.
+    push() writes one slot and the header and only marks these bytes, iterating gives the samples from the oldest
+    without copying them.
+    """
+    def __init__(self, reg, off, n, c):
+        self.reg, self.off, self.buf = reg, off, reg.buf
+        self._ring(n, c)
+
+    def _ring(self, n, c):
+        self.n, self.c, self.sz = n, c, struct.calcsize('<' + c)
+        self._sgn = c in 'bhilq'
+
+    def _u16(self, o):
+        return self.buf[o] | self.buf[o + 1] << 8
+
+    def _head(self):
+        h = self._u16(self.off)
+        return h if h < self.n else 0
+
+    def __len__(self):
+        f = self._u16(self.off + 2)
+        return f if f <= self.n else 0
+
+    def _get(self, slot):
+        b, sz, p = self.buf, self.sz, self.off + 4 + slot * self.sz
+        if self.c in 'fd':
+            return struct.unpack_from('<' + self.c, b, p)[0]
+        if sz == 1:
+            v = b[p]
+        else:
+            v = 0
+            for k in range(p + sz - 1, p - 1, -1):
+                v = v << 8 | b[k]
+        return v - (1 << 8 * sz) if self._sgn and v >> (8 * sz - 1) else v
+
+    def _set(self, slot, v):
+        b, sz, p = self.buf, self.sz, self.off + 4 + slot * self.sz
+        if self.c in 'fd':
+            struct.pack_into('<' + self.c, b, p, v)
+        else:
+            for k in range(p, p + sz):
+                b[k] = v & 0xFF
+                v >>= 8
+        self.reg._mark(p, p + sz)
+
+    def _hdr(self, h, f):
+        b, o = self.buf, self.off
+        b[o], b[o + 1], b[o + 2], b[o + 3] = h & 0xFF, h >> 8, f & 0xFF, f >> 8
+        self.reg._mark(o, o + 4)
+
+    def push(self, v):
+        """ Adds a sample, the oldest one is overwritten when the ring is full """
+        _cnt(self.reg.name, 1) if _ST is not None else None
+        h, f = self._head(), len(self)
+        self._set(h, v)
+        self._hdr(h + 1 if h + 1 < self.n else 0, f + 1 if f < self.n else f)
+
+    def clear(self):
+        self._hdr(0, 0)
+
+    def __getitem__(self, i):
+        # i-th oldest sample, -1 is the newest
+        f = len(self)
+        if i < 0:
+            i += f
+        if not 0 <= i < f:
+            raise IndexError('ring index out of range')
+        return self._get((self._head() - f + i) % self.n)
+
+    def __iter__(self):
+        n, f = self.n, len(self)
+        s = self._head() - f
+        for i in range(f):
+            yield self._get((s + i) % n)
+
+    @property
+    def value(self):
+        _cnt(self.reg.name, 0) if _ST is not None else None
+        return tuple(self)
+
+    @value.setter
+    def value(self, v):
+        self.ch_val(v)
+
+    def ch_val(self, v):
+        """ An iterable replaces the samples, a single value is pushed """
+        if isinstance(v, Ring) and v.reg is self.reg and v.off == self.off:
+            return # reg['RING'] += x already pushed x
+        if isinstance(v, (tuple, list, bytes, bytearray)):
+            self.clear()
+            for x in v[-self.n:]:
+                self.push(x)
+        else:
+            self.push(v)
+
+    def __iadd__(self, v):
+        self.push(v)
+        return self
+
+    def __str__(self):
+        return str(self.value)
+
 try:
-    import uctypes
+    try:
+        import uctypes
+    except ImportError:
+        if sys.implementation.name != 'cpython':
+            raise
+        import hostuctypes as uctypes # pure python stand-in, to run the Struct classes on your computer
+
+    def _ucsz(t):
+        # size in bytes of a uctypes scalar type
+        t = (t >> 27) & 0xF
+        return 4 if t == 14 else 8 if t == 15 else 1 << (((t - 8) if t > 7 else t) >> 1)
+
     class Struct(Mem):
         """
         This class dynamically creates and manages a memory-mapped structure using uctypes.struct.
         Structs can be fickle. Be sure that the memory area you give it is big enough otherwise it will crash micropython.
         """
-        def __init__(self, name, mem, offset, *args, span=32):
-            super().__init__(name, mem, offset, span)
-            self._hsh = hash(args + tuple([offset, span]))
+        def __init__(self, name, mem, offset, *args, span=32, layout=None, buf=None, direct=False, check=0):
+            super().__init__(name, mem, offset, span, buf is None, buf, direct, check=check)
             self.layout = {}
-            sav =  CACHE.get(self.name, self._hsh)
-            if not sav:
-                self._parse_args(args)
-                CACHE.push(self.name, self.layout, self._hsh)
+            if layout is not None:
+                # layout made by memcompile.py, no parsing and no cache
+                self.layout = layout
             else:
-                self.layout = sav
+                self._hsh = _fp(type(self).__name__, args, offset, span)
+                sav =  CACHE.get(self.name, self._hsh)
+                if not sav:
+                    self._parse_args(args)
+                    CACHE.push(self.name, self.layout, self._hsh)
+                else:
+                    self.layout = sav
             self.struct = uctypes.struct(uctypes.addressof(self.buf), self.layout, uctypes.LITTLE_ENDIAN)
+            self.rings = {}
+            for k in self.layout:
+                if k[-1:] == '#': # header of a ring, its slots are an array under the ring's name
+                    v = self.layout[k[:-1]][1]
+                    t = (v >> 27) & 0xF
+                    self.rings[k[:-1]] = Ring(self, self.layout[k] & 0x1FFFF, v & 0xFFFF, 'BbHhIiQq'[t] if t < 8 else 'fd'[t - 14])
 
         def __getitem__(self, it):
-            return getattr(self.struct, it)
+            _cnt(self.name, 0) if _ST is not None else None
+            if it in self.rings:
+                return self.rings[it]
+            return getattr(self.struct, it) # arrays are views on buf, touch(it) after writing through one
 
         def __setitem__(self, key, value):
-            if type(value) in (str, bytes, bytearray):
-                value = value.encode('utf-8') if type(value) is str else value
-                for i, b in enumerate(value):
-                    self[key][i] = b
+            if key in self.rings:
+                self.rings[key].ch_val(value)
+            elif type(value) in (str, bytes, bytearray, memoryview, list, tuple):
+                self.put(key, value)
+                return
             else:
                 setattr(self.struct, key, value)
+                self._mark(*self._rng(key))
+            _cnt(self.name, 1) if _ST is not None else None
+
+        def put(self, key, data, pad=True):
+            """
+                Copies data to an array item: bytes and str in a single copy, lists and tuples element by element.
+                The rest of the item is filled with zeros, unless pad is False. Data longer than the item raises ValueError.
+            """
+            _cnt(self.name, 1) if _ST is not None else None
+            a, b = self._rng(key)
+            if type(data) in (list, tuple):
+                arr = getattr(self.struct, key)
+                n = len(data)
+                if n > len(arr):
+                    raise ValueError('value is longer than the item')
+                for i in range(n):
+                    arr[i] = data[i]
+                n *= (b - a) // len(arr)
+            else:
+                data = data.encode() if type(data) is str else data
+                n = len(data)
+                if n > b - a:
+                    raise ValueError('value is longer than the item')
+                self.buf[a:a + n] = data
+            if pad:
+                for i in range(a + n, b):
+                    self.buf[i] = 0
+            self._mark(a, b if pad else a + n)
+
+        def _rng(self, key):
+            # (start, end) of the bytes used by an item in buf
+            v = self.layout[key]
+            if type(v) is tuple:
+                o = v[0] & 0x1FFFF
+                return o, o + (v[1] & 0xFFFF) * _ucsz(v[1])
+            return v & 0x1FFFF, (v & 0x1FFFF) + _ucsz(v)
 
         def __str__(self):
-            return '\n'.join(str(v)+": "+str(self[v]) for v in self.layout.keys())
+            return '\n'.join(str(v)+": "+str(self[v]) for v in self.layout.keys() if v[-1:] != '#')
 
         #@micropython.native
         def _parse_args(self, ar):
@@ -121,12 +647,14 @@ try:
                 bit_pos = 0
             for dt in l:
                 # name, length, bin, format
-                if dt[3] == uctypes.ARRAY:
+                if type(dt[3]) is tuple:
+                    byte_pos = self._lay_agg(dt[0], dt[1], dt[3], byte_pos)
+                elif dt[3] == uctypes.ARRAY:
                     self.layout.update({dt[0]: (byte_pos | dt[3], dt[1] | uctypes.UINT8)})
                     byte_pos += dt[1]
                 else:
                     self.layout.update({dt[0]: (byte_pos | dt[3])})
-                    byte_pos = byte_pos + (2 ** ((dt[3] >> 28) & 0xF)) * dt[1] if dt[3] not in (uctypes.FLOAT32, uctypes.FLOAT64) else 4 if dt[3] is uctypes.FLOAT32 else 8
+                    byte_pos += _ucsz(dt[3]) * dt[1]
 
         @staticmethod
         def _ngst(name, span, *rst):
@@ -139,38 +667,281 @@ try:
                     bn = rst[0]
                 else:
                     fmt = rst[0]
+            if type(fmt) is str and (fmt == 'RING' or ':' in fmt): # 'RING', 'RING:UINT16', 'ARRAY:UINT16'
+                k, _, t = fmt.partition(':')
+                return name, span, bn, (k, getattr(uctypes, t or 'UINT8'))
             fmt = uctypes.UINT8 if not fmt else getattr(uctypes, fmt)
             return name, span, bn, fmt
 
+        def _lay_agg(self, name, n, fmt, p):
+            # typed arrays and rings, a ring is its header (head and fill, H each) at name#, then its slots
+            if fmt[0] == 'RING':
+                self.layout[name + '#'] = p | uctypes.UINT32
+                p += 4
+            self.layout[name] = (p | uctypes.ARRAY, n | fmt[1])
+            return p + n * _ucsz(fmt[1])
+
         def toggle(self, key):
             self[key] = self[key] ^ 1
+
+        def touch(self, key=None):
+            """ Marks an item (or the whole buffer) as dirty, use it after writing through an array's view """
+            self._mark(*self._rng(key)) if key is not None else Mem.touch(self)
 except ImportError:
     pass
 
         
+_FMTS = {} # struct formats of the items, shared by all the registers: {length << 8 | format char: '<nC'}
+
+def _sfmt(c, n):
+    k = n << 8 | c
+    f = _FMTS.get(k)
+    if f is None:
+        f = _FMTS[k] = '<%d%s' % (n, chr(c))
+    return f
+
+def _le(b, o, n):
+    # little endian unsigned int of b[o:o + n], without slicing
+    v = 0
+    while n:
+        n -= 1
+        v = v << 8 | b[o + n]
+    return v
+
+def _enc(t, j, length, bin=False, pack_format=False):
+    # writes the layout bytes of an item made from the register's arguments at t[j:j + 4], its position comes later
+    if bin:
+        if not 0 < length <= 32:
+            raise ValueError('binary items are 1 to 32 bits long')
+        t[j] |= 1 << 7
+    if pack_format and pack_format[:4] == 'RING': # 'RING' or 'RING:H'
+        if not 0 < length < 4096:
+            raise ValueError('rings hold 1 to 4095 samples')
+        t[j] |= 1 << 4 | length >> 8
+        pack_format = pack_format[5:] or 'B'
+    elif length > 255:
+        raise ValueError('items hold up to 255 values, only rings can be longer')
+    t[j + 1] = ord(pack_format) if pack_format else ord('B')
+    sz = struct.calcsize('<' + chr(t[j + 1]))
+    t[j] |= ((sz > 1) + (sz > 2) + (sz > 4)) << 5
+    t[j + 2] = length & 0xFF
+
+def _at(t, j, o):
+    # puts the item at t[j:j + 4] at byte o, its position has a single byte
+    if o > 255:
+        raise ValueError('items must start in the first 256 bytes, put the long ones (rings) last')
+    t[j + 3] = o
+
 class Pack(Mem):
     """
     Pythonic class that manages memory-mapped registers with individual items.
     Can be a better choice when uctypes.struct is too rigid.
+    The layout is one table of 4 bytes per item (see Memitem) and a dict of the item numbers by name, the Memitem
+    register['NAME'] returns is made from them the first time it's asked for, then kept.
     """
-    def __init__(self, name, mem, offset, *args, span = 32):
-        super().__init__(name, mem, offset, span)
-        self._hsh = hash(args + tuple([offset, span]))
-        self.items = {}
-        sav = CACHE.get(self.name, self._hsh)
+    def __init__(self, name, mem, offset, *args, span = 32, layout = None, buf = None, direct = False, irq = False,
+                 check = 0):
+        super().__init__(name, mem, offset, span, buf is None, buf, direct, irq, check)
+        self._fclr = self._fset = None # scratch masks of set_flags()
+        self._fmt = None # made by _compile() the first time it's needed
+        self._fly = {} # items already asked for, made once from the table
+        sav = layout # layout made by memcompile.py, no parsing and no cache
+        if sav is None:
+            self._hsh = _fp(type(self).__name__, args, offset, span)
+            sav = CACHE.get(self.name, self._hsh)
         if not sav:
-            self.items = {ar[0]: Memitem(i, *ar) for i, ar in enumerate(args)}
+            self._ix, self._tb = {ar[0]: i for i, ar in enumerate(args)}, bytearray(4 * len(args))
+            for i, ar in enumerate(args):
+                _enc(self._tb, 4 * i, *ar[1:])
             self._order_items()
-            CACHE.push(self.name, {
-                k: {attr: (int.from_bytes(val, 'big') if attr == "inreg" else val) for attr, val in v.__dict__.items() if
-                    attr not in ("memref", "buf")} for k, v in self.items.items()}, self._hsh)
+            CACHE.push(self.name, self._layout(), self._hsh)
         else:
-            for k, d in sav.items():
-                self.items[k] = Memitem.from_dict(d, self)
+            self._ix, self._tb = {}, bytearray(4 * len(sav))
+            for k, (i, v) in sav.items():
+                self._ix[k] = i
+                self._tb[4 * i:4 * i + 4] = (v & 0xFFFFFFFF).to_bytes(4, 'big')
+        if irq: # all made now, so an interrupt handler doesn't have to make them
+            for k in self._ix:
+                self[k]
+
+    def _layout(self):
+        # what is saved in the cache: {name: (indx, inreg)}
+        t = self._tb
+        return {k: (i, int.from_bytes(t[4 * i:4 * i + 4], 'big')) for k, i in self._ix.items()}
 
-    def __str__(self): return '\n'.join(str(v) for v in self.items.values())
-    def __getitem__(self, k): return self.items[k]
-    def __setitem__(self, k, v): self.items[k].ch_val(v)
+    def _mk(self, i):
+        # item number i, made from the table
+        return (RingItem if self._tb[4 * i] & 0x90 == 0x10 else IrqItem if self.irq else Memitem)(self, i)
+
+    def _isz(self, i):
+        # bytes taken by item number i
+        t, j = self._tb, 4 * i
+        b0 = t[j]
+        if b0 & (1 << 7):
+            return ((b0 & 0b11111) + t[j + 2] + 7) >> 3
+        sz = 1 << ((b0 >> 5) & 0b11)
+        return 4 + (t[j + 2] | (b0 & 0xF) << 8) * sz if b0 & (1 << 4) else t[j + 2] * sz
+
+    @property
+    def items(self):
+        """ {name: item} of all the items, made on demand """
+        return {k: self[k] for k in self._ix}
+
+    def __str__(self): return '\n'.join(str(self[k]) for k in self._ix)
+    def __getitem__(self, k):
+        try:
+            return self._fly[k]
+        except KeyError: # first time: made from the table and kept
+            it = self._fly[k] = self._mk(self._ix[k])
+            return it
+
+    def __setitem__(self, k, v): self[k].ch_val(v)
+
+    def _compile(self):
+        """
+            Builds one struct format covering the whole layout, for snapshot() and update().
+            Consecutive bytes holding binary items are read as one bytes value (a bit run) and turned into an int.
+            _ents maps each item to (value index, count or bit shift, bit mask or 0)
+        """
+        fmt, p, vi, run = '<', 0, 0, None
+        self._ents, self._bvi = {}, []
+        t = self._tb
+        for nm, k in sorted(self._ix.items(), key=lambda e: t[4 * e[1] + 3]):
+            j, off, nb = 4 * k, t[4 * k + 3], self._isz(k)
+            if t[j] & (1 << 7):
+                e = off + nb - 1 # last byte of the item
+                if run and off <= run[1] + 1:
+                    run[1] = max(run[1], e)
+                else:
+                    if run:
+                        fmt += '%ds' % (run[1] - run[0] + 1)
+                        self._bvi.append((vi, run[1] - run[0] + 1))
+                        vi += 1
+                        p = run[1] + 1
+                    fmt += 'x' * (off - p)
+                    run = [off, e]
+                self._ents[nm] = (vi, (off - run[0]) * 8 + (t[j] & 0b11111), (1 << t[j + 2]) - 1)
+                continue
+            if run:
+                fmt += '%ds' % (run[1] - run[0] + 1)
+                self._bvi.append((vi, run[1] - run[0] + 1))
+                vi += 1
+                p, run = run[1] + 1, None
+            fmt += 'x' * (off - p)
+            if t[j] & (1 << 4): # ring, read as raw bytes and handed to the item
+                fmt += '%ds' % nb
+                self._ents[nm] = (vi, 1, -1)
+                vi += 1
+            elif t[j + 1] == 66: # raw bytes
+                fmt += '%ds' % nb
+                self._ents[nm] = (vi, 1, 0)
+                vi += 1
+            else:
+                fmt += '%d%s' % (t[j + 2], chr(t[j + 1]))
+                self._ents[nm] = (vi, t[j + 2], 0)
+                vi += t[j + 2]
+            p = off + nb
+        if run:
+            fmt += '%ds' % (run[1] - run[0] + 1)
+            self._bvi.append((vi, run[1] - run[0] + 1))
+        self._fmt = fmt
+
+    def _unpack(self, b=None, o=0, k=1):
+        # values of k layouts laid one after the other from b[o:], bit runs turned into ints
+        self._compile() if self._fmt is None else None
+        v = list(struct.unpack_from(self._fmt if k == 1 else '<' + self._fmt[1:] * k, self.buf if b is None else b, o))
+        nv = len(v) // k
+        for j in range(0, len(v), nv):
+            for i, _ in self._bvi:
+                v[j + i] = int.from_bytes(v[j + i], 'little')
+        return v
+
+    def _vals(self, v, j=0):
+        # dict of the item values, from the values of a layout starting at v[j]
+        return {nm: (self[nm].value if mk < 0 else (v[j + i] >> n) & mk if mk else v[j + i] if n == 1 else tuple(v[j + i:j + i + n])) for nm, (i, n, mk) in self._ents.items()}
+
+    def _pack(self, v, fields, b=None, o=0):
+        # changes fields in v, the values of a layout, and packs it back at b[o:]
+        for nm, val in fields.items():
+            i, n, mk = self._ents[nm]
+            if mk < 0:
+                continue # rings are changed after
+            elif mk:
+                v[i] = v[i] & ~(mk << n) | (int(val) & mk) << n
+            elif n == 1:
+                if type(val) is str:
+                    val = val.encode()
+                elif type(val) is int and type(v[i]) is bytes: # a 'B' item of length 1 is a 1 byte string
+                    val = bytes((val,))
+                v[i] = val
+            else:
+                v[i:i + n] = val
+        for i, ln in self._bvi:
+            v[i] = v[i].to_bytes(ln, 'little')
+        struct.pack_into(self._fmt, self.buf if b is None else b, o, *v)
+
+    def snapshot(self):
+        """ Returns a dict with the values of all the items, read with a single struct call """
+        v = self._unpack()
+        _cnt(self.name, 0, len(self._ents)) if _ST is not None else None
+        return self._vals(v)
+
+    def update(self, **fields):
+        """ Changes many items at once, the whole layout is written back with a single struct call """
+        _cnt(self.name, 1, len(fields)) if _ST is not None else None
+        self._pack(self._unpack(), fields)
+        for nm in fields:
+            i = self._ix[nm]
+            o = self._tb[4 * i + 3]
+            self._mark(o, o + self._isz(i))
+            if self._ents[nm][2] < 0:
+                self[nm].ch_val(fields[nm])
+
+    def set_flags(self, **flags):
+        """
+            Changes many binary items at once: their masks are merged per byte first, then each byte of the buffer is
+            changed once, however many items share it
+        """
+        _cnt(self.name, 1, len(flags)) if _ST is not None else None
+        if self._fclr is None:
+            self._fclr, self._fset = bytearray(self.span), bytearray(self.span)
+        clr, st, b, t, lo, hi = self._fclr, self._fset, self.buf, self._tb, self.span, 0
+        for nm, val in flags.items():
+            j = 4 * self._ix[nm]
+            if not t[j] & (1 << 7):
+                raise AttributeError(nm + ' is not defined as binary')
+            p, ln, o = t[j] & 0b11111, t[j + 2], t[j + 3]
+            m, n = ((1 << ln) - 1) << p, (p + ln + 7) >> 3
+            v = ((1 if val else 0) if ln == 1 else int(val)) << p & m
+            if n == 1:
+                clr[o] |= m
+                st[o] |= v
+            else:
+                for k in range(n):
+                    clr[o + k] |= (m >> (k * 8)) & 0xFF
+                    st[o + k] |= (v >> (k * 8)) & 0xFF
+            lo, hi = min(lo, o), max(hi, o + n)
+        for k in range(lo, hi):
+            if clr[k]:
+                b[k] = b[k] & ~clr[k] | st[k]
+                clr[k] = st[k] = 0
+        if lo < hi:
+            self._mark(lo, hi)
+            self.seq = (self.seq + 1) & 0xFF
+
+    def get_flags(self, *names):
+        """ Returns a dict with the values of the binary items named, or of all of them """
+        t = self._tb
+        names = names or [k for k, i in self._ix.items() if t[4 * i] & (1 << 7)]
+        _cnt(self.name, 0, len(names)) if _ST is not None else None
+        r = {}
+        for nm in names:
+            j = 4 * self._ix[nm]
+            if not t[j] & (1 << 7):
+                raise AttributeError(nm + ' is not defined as binary')
+            p = t[j] & 0b11111
+            r[nm] = _le(self.buf, t[j + 3], (p + t[j + 2] + 7) >> 3) >> p & ((1 << t[j + 2]) - 1)
+        return r
 
     #@micropython.native
     def _order_items(self):
@@ -178,26 +949,24 @@ class Pack(Mem):
             This function ensures that all items stay in the same order every time
             It also makes it very easy to combine bits with bytes
         """
-        wdcsr, bt_csr = 0, 0
-        # binary items
-        for itm in sorted((i for i in self.items.values() if i.inreg[0] & (1 <<7)), key=lambda obj: obj.indx):
-            if bt_csr >= 8:
-                wdcsr += 1
-                bt_csr %= 8
-            itm.inreg[3] = wdcsr
-            itm.inreg[0] |= bt_csr & ((1 << 6)-1)
-            itm.mask = 1 << bt_csr
-            bt_csr += itm.inreg[2]
-            itm.memref = memoryview(self.buf)[itm.inreg[3]:itm.inreg[3] + 1]
-        if bt_csr > 0:
-            wdcsr += 1
+        t, bt_csr = self._tb, 0
+        # binary items, bit fields can cross bytes
+        for j in range(0, len(t), 4):
+            if t[j] & (1 << 7):
+                _at(t, j, bt_csr >> 3)
+                t[j] |= bt_csr & 7
+                bt_csr += t[j + 2]
+        wdcsr = (bt_csr + 7) >> 3
         # Non-binary items
-        for itm in sorted((i for i in self.items.values() if not i.inreg[0] & (1<<7)), key=lambda obj: obj.indx):
-            itm.inreg[3] = wdcsr
-            wdcsr += (2 ** ((itm.inreg[0] >> 5) & 0b11)) * itm.inreg[2]
-            itm.memref = memoryview(self.buf)[itm.inreg[3]:itm.inreg[3] + itm.inreg[2]*(1 <<((itm.inreg[0] >>5)&0b11))]
+        for j in range(0, len(t), 4):
+            if not t[j] & (1 << 7):
+                _at(t, j, wdcsr)
+                wdcsr += self._isz(j >> 2)
 
 class Memitem:
+    """
+    Item of a Pack. It's made on demand from the register's table, where each item takes 4 bytes (inreg):
+    """
     # BITPOS  = 5 BITS : inreg[0], bit 0-4
     # BIN = 1 BIT : inreg[0], bit 7
     # PACKFMT =  8 BITS: inreg[1]
@@ -205,40 +974,53 @@ class Memitem:
     # LENGTH = 8 BITS : inreg[2]
     # BYTEPOS = 8 BITS : inreg[3]
 
-    __slots__ = ('indx','name','length','pack_format','memref','mask', 'inreg', 'bin')
-    @classmethod
-    def from_dict(cls,d, reg):
-        obj = cls(d['indx'], d['name'], 0, inreg=d['inreg'])
-        obj.length = obj.inreg[2]
-        obj.memref = memoryview(reg.buf)[obj.inreg[3]:obj.inreg[3] + (1 if (obj.inreg[0] & (1<<7)) else obj.inreg[2]*2**((obj.inreg[0]>>5)&0b11))]
-        obj.mask = 1 << (obj.inreg[0] & 0b11111)
-        return obj
-
-    def __init__(self,indx, name, length, bin = False, pack_format=False, inreg= None):
-        self.indx = indx
-        self.name = name
-        if not inreg:
-            self.inreg = bytearray(4)
-            if bin:
-                self.inreg[0] |= 1 << 7
-            if pack_format:
-                self.inreg[1] = ord(pack_format)
-            else:
-                self.inreg[1] = ord('B')
-            try:
-                self.inreg[0] |= ((len(struct.pack(chr(self.inreg[1]), 0)) >> 1) & 3) << 5
-            except TypeError:
-                pass
+    # RING = 1 BIT : inreg[0], bit 4, then bits 0-3 are the high bits of LENGTH
+
+    __slots__ = ('reg', 'indx', 'off', 'pos', 'mask', 'fmt') # the rest comes from reg, items are kept
 
-            self.inreg[2] = length
+    def __init__(self, reg, indx):
+        t, j = reg._tb, 4 * indx
+        self.reg, self.indx, self.off = reg, indx, t[j + 3]
+        if t[j] & (1 << 7):
+            # bit field: mask over its bytes read as a little endian int
+            self.pos = t[j] & 0b11111
+            self.mask = ((1 << t[j + 2]) - 1) << self.pos
+            self.fmt = None
         else:
-            self.inreg = inreg.to_bytes(4, 'big')
-        self.memref = None
-        self.mask = 0
+            self.pos = self.mask = 0
+            self.fmt = _sfmt(t[j + 1], t[j + 2])
+
+    @property
+    def buf(self):
+        return self.reg.buf
+
+    @property
+    def nb(self):
+        # bytes of the item
+        return self.reg._isz(self.indx)
+
+    @property
+    def name(self):
+        for k, i in self.reg._ix.items():
+            if i == self.indx:
+                return k
+
+    @property
+    def inreg(self):
+        return bytes(self.reg._tb[4 * self.indx:4 * self.indx + 4])
 
     @property
     def value(self):
-        return (lambda v: v[0] if isinstance(v, tuple) and len(v) == 1 else v)(struct.unpack(chr(self.inreg[1]), bytes(self.memref))) if self.inreg[1] != ord('B') else (bytes(self.memref) if not self.inreg[0] & (1 << 7) else (bytes(self.memref)[0] >> (self.inreg[0] & 0b11111)) & 1)
+        r, o, m = self.reg, self.off, self.mask
+        _cnt(r.name, 0) if _ST is not None else None
+        if m:
+            if m < 0x100: # within one byte
+                return (r.buf[o] & m) >> self.pos
+            return (_le(r.buf, o, r._isz(self.indx)) & m) >> self.pos
+        if self.fmt[-1] == 'B': # 'B' items are raw bytes
+            return bytes(r.buf[o:o + r._isz(self.indx)])
+        v = struct.unpack_from(self.fmt, r.buf, o)
+        return v[0] if len(v) == 1 else v
 
     @value.setter
     def value(self, new_dt):
@@ -246,35 +1028,139 @@ class Memitem:
 
     @property
     def raw_val(self):
-        return bytes(self.memref) if not self.inreg[0] & (1<<7) else (bytes(self.memref)[0] >> (self.inreg[0] & 0b11111)) & 1
+        b, o, n = self.reg.buf, self.off, self.reg._isz(self.indx)
+        return bytes(b[o:o + n]) if not self.mask else (_le(b, o, n) & self.mask) >> self.pos
 
     def __iadd__(self, other):
-        if self.inreg[2] is 1:
-            return self.value[0] + other
+        if self.reg._tb[4 * self.indx + 2] == 1:
+            v = self.value
+            return (v[0] if type(v) is bytes else v) + other
         else:
             raise TypeError("Cannot use += on non scalar values")
 
     def __str__(self):
-        return f'{self.name}: \n\t index = {self.indx}\n\t val ={self.value}\n\t byte_pos = {self.inreg[3]}\n\t bin = {bool(self.inreg[0] >> 7)}\n\t bit_pos = {self.inreg[0]&0b11111}'
+        return f'{self.name}: \n\t index = {self.indx}\n\t val ={self.value}\n\t byte_pos = {self.off}\n\t bin = {bool(self.mask)}\n\t bit_pos = {self.pos}'
 
     #@micropython.native
     def ch_val(self, new_val):
-        if self.inreg[0] & (1<<7): # Binary
-            self.memref[:] = bytes([self.memref[0] | self.mask]) if new_val else bytes([self.memref[0] &~ self.mask])
-        elif isinstance(new_val, (bytes, bytearray, str)):
-            new_val = new_val.encode() if isinstance(new_val, str) else new_val
-            if len(self.memref) > len(new_val):
-                new_val = new_val + b'\x00' * (len(self.memref) - len(new_val))  # Adjust the length of v.buf
-            self.memref[:] = new_val
+        r, o, m = self.reg, self.off, self.mask
+        _cnt(r.name, 1) if _ST is not None else None
+        b = r.buf
+        if m: # Binary
+            v = ((1 if new_val else 0) if m == 1 << self.pos else int(new_val)) << self.pos & m
+            if m < 0x100: # within one byte
+                b[o] = b[o] & ~m | v
+                r._dm[o >> 3] |= 1 << (o & 7)
+                return
+            n = r._isz(self.indx)
+            v |= _le(b, o, n) & ~m
+            for k in range(n):
+                b[o + k] = (v >> (k * 8)) & 0xFF
         else:
-            self.memref[:] = struct.pack(chr(self.inreg[1])*self.inreg[2], new_val)
+            n = r._isz(self.indx)
+            if type(new_val) is int or type(new_val) is float:
+                struct.pack_into(self.fmt, b, o, new_val)
+            elif isinstance(new_val, (bytes, bytearray, str)):
+                new_val = new_val.encode() if isinstance(new_val, str) else new_val
+                k = len(new_val)
+                if k > n:
+                    raise ValueError('value is longer than the item')
+                b[o:o + k] = new_val
+                for i in range(o + k, o + n): # pads the rest of the item with zeros
+                    b[i] = 0
+            elif isinstance(new_val, (tuple, list)):
+                struct.pack_into(self.fmt, b, o, *new_val)
+            else:
+                struct.pack_into(self.fmt, b, o, new_val)
+        k = o >> 3 # marks buf[o:o + n], without calling _mark when it's within one byte of the map
+        if k == (o + n - 1) >> 3:
+            r._dm[k] |= (0xFF >> (8 - n)) << (o & 7)
+        else:
+            r._mark(o, o + n)
 
     def toggle(self):
-        if not (self.inreg[0] >> 7) & 1:
+        if not self.mask:
             raise AttributeError('item is not defined as binary, cannot toggle!')
-        if self.inreg[2] >1:
+        if self.mask != 1 << self.pos:
             raise ValueError("item's length is superior to 1, cannot toggle")
-        self.memref[:] = bytes([self.memref[0] ^ self.mask])
+        o = self.off
+        self.reg.buf[o] ^= self.mask
+        self.reg._dm[o >> 3] |= 1 << (o & 7)
+        _cnt(self.reg.name, 1) if _ST is not None else None
+
+class IrqItem(Memitem):
+    """
+    Item of a Pack made with irq=True. Integers and bit fields are read and written byte by byte, without allocating,
+    so they can be used in an interrupt handler. A read is done again if an interrupt changed the register meanwhile.
+    Floats, bytes and arrays work like in Memitem and allocate.
+    """
+    __slots__ = ()
+
+    def _sz(self):
+        # size of an integer item, 0 for the others
+        t, j = self.reg._tb, 4 * self.indx
+        if self.mask or t[j + 2] != 1 or t[j + 1] in (66, 101, 102, 100): # 'B' bytes, 'e', 'f', 'd'
+            return 0
+        return self.reg._isz(self.indx)
+
+    @property
+    def value(self):
+        sz = self._sz()
+        if not sz and not self.mask:
+            return Memitem.value.fget(self)
+        o, r = self.off, self.reg
+        b = r.buf
+        _cnt(r.name, 0) if _ST is not None else None
+        n = sz or r._isz(self.indx)
+        while True:
+            s, k = r.seq, n - 1
+            v = b[o + k]
+            if sz and v & 0x80 and r._tb[4 * self.indx + 1] in (98, 104, 105, 108, 113): # signed 'bhilq'
+                v -= 0x100
+            while k:
+                k -= 1
+                v = v << 8 | b[o + k]
+            if r.seq == s:
+                return v if sz else (v & self.mask) >> self.pos
+
+    @value.setter
+    def value(self, new_dt):
+        self.ch_val(new_dt)
+
+    def ch_val(self, new_val):
+        r = self.reg
+        sz = self._sz()
+        if not sz and not self.mask:
+            Memitem.ch_val(self, new_val)
+        else:
+            _cnt(r.name, 1) if _ST is not None else None
+            if sz:
+                n, m = sz, -1
+            else:
+                n, m = r._isz(self.indx), self.mask
+                new_val = ((1 if new_val else 0) if m == 1 << self.pos else int(new_val)) << self.pos & m
+            b, o, k = r.buf, self.off, 0
+            while k < n:
+                b[o + k] = b[o + k] & (m & 0xFF ^ 0xFF) | new_val & 0xFF
+                new_val >>= 8
+                m >>= 8
+                k += 1
+            r._mark(o, o + n)
+        r.seq = (r.seq + 1) & 0xFF
+
+    def toggle(self):
+        Memitem.toggle(self)
+        self.reg.seq = (self.reg.seq + 1) & 0xFF
+
+class RingItem(Ring, Memitem):
+    """ Ring buffer item of a Pack: ('NAME', samples, False, 'RING') or 'RING:<struct format>' """
+    def __init__(self, reg, indx):
+        Memitem.__init__(self, reg, indx)
+        t, j = reg._tb, 4 * indx
+        self._ring(t[j + 2] | (t[j] & 0xF) << 8, chr(t[j + 1]))
+
+    __str__ = Memitem.__str__
+
 try:
     class OrderedStruct(Struct):
         def __init__(self, *args, **kwargs):
@@ -293,48 +1179,67 @@ try:
                 else:
                     if bit_pos > 0:
                         byte_pos += 1
-                    if args[3] == uctypes.ARRAY:
+                        bit_pos = 0
+                    if type(args[3]) is tuple:
+                        byte_pos = self._lay_agg(args[0], args[1], args[3], byte_pos)
+                    elif args[3] == uctypes.ARRAY:
                         self.layout.update({args[0]: (byte_pos | args[3], args[1] | uctypes.UINT8)})
                         byte_pos+= args[1]
                     else:
                         self.layout.update({args[0]: (byte_pos | args[3])})
-                        byte_pos = byte_pos + (2 ** ((args[3] >> 28) & 0xF)) * args[1] if args[3] not in (uctypes.FLOAT32, uctypes.FLOAT64) else 4 if args[3] is uctypes.FLOAT32 else 8
+                        byte_pos += _ucsz(args[3]) * args[1]
 
 
     class IndexBinStruct(Struct):
-        def __init__(self, name, mem, offset, *args, span=32):
-            import machine
-            self._hsh = hash(args + tuple([offset, span]))
+        def __init__(self, name, mem, offset, *args, span=32, layout=None):
+            try:
+                from machine import mem8, mem16, mem32
+            except ImportError:
+                from hostuctypes import mem8, mem16, mem32
 
             if span in (8, 16, 32):
                 self.fmt = f"BFUINT{span}"
             else:
                 raise ValueError("span must be 8, 16 or 32")
-            span = span // 8  # for the buffer
-            Mem.__init__(self, name, uctypes.addressof(mem), offset, span, False)
+            Mem.__init__(self, name, uctypes.addressof(mem), offset, span // 8, False) # span // 8 for the buffer
             self.layout = {}
-            sav = CACHE.get(self.name, self._hsh)
-
-            if not sav:
-                for ar in args:
-                    # name, position, span
-                    self.layout.update(
-                        {ar[0]: 0 | (ar[1] << uctypes.BF_POS) | (ar[2] << uctypes.BF_LEN) | getattr(uctypes, self.fmt)})
-                CACHE.push(self.name, self.layout, self._hsh)
+            self.rings = {}
+            if layout is not None:
+                self.layout = layout
             else:
-                self.layout = sav
+                self._hsh = _fp(type(self).__name__, args, offset, span)
+                sav = CACHE.get(self.name, self._hsh)
+                if not sav:
+                    self._parse_args(args)
+                    CACHE.push(self.name, self.layout, self._hsh)
+                else:
+                    self.layout = sav
 
             self.buf_adr = uctypes.addressof(self.buf)
-            self.mmtd = machine.mem32 if span == 4 else machine.mem16 if span == 2 else machine.mem8
+            self.mmtd = mem32 if self.span == 4 else mem16 if self.span == 2 else mem8
             self.struct = uctypes.struct(uctypes.addressof(self.buf), self.layout, uctypes.LITTLE_ENDIAN)
             self.ld_buf()
 
+        def _parse_args(self, ar):
+            for args in ar:
+                # name, position, span
+                self.layout.update(
+                    {args[0]: 0 | (args[1] << uctypes.BF_POS) | (args[2] << uctypes.BF_LEN) | getattr(uctypes, self.fmt)})
+
         def post_all(self):
+            if not self.dirty:
+                return
+            t = _TM() if _TM else 0
             self.mmtd[self.mem + self.memstart] = self.mmtd[self.buf_adr]
+            self.written += self.span
+            _done(self, 0, self.span, t) if _ST is not None else None
             self.ld_buf()
 
         def ld_buf(self):
+            t = _TM() if _TM else 0
             self.buf[:] = self.mmtd[self.mem + self.memstart].to_bytes(self.span, 'little')
+            self._clean()
+            _done(self, 1, self.span, t) if _ST is not None else None
 
 except NameError:
     pass
@@ -344,23 +1249,494 @@ class OrderedPack(Pack):
         super().__init__(*args, **kwargs)
 
     def _order_items(self):
-        wdcsr, bt_csr = 0, 0
-        for itm in sorted((i for i in self.items.values()), key=lambda obj: obj.indx):
+        t, wdcsr, bt_csr = self._tb, 0, 0
+        for j in range(0, len(t), 4):
             # binary items (name, position, span)
-            if itm.inreg[0] & (1 << 7):
-                if bt_csr >= 8:
-                    wdcsr += 1
-                    bt_csr %= 8
-                itm.inreg[3] = wdcsr
-                itm.inreg[0] |= bt_csr & ((1 << 6) - 1)
-                itm.mask = 1 << bt_csr
-                bt_csr += itm.inreg[2]
-                itm.memref = memoryview(self.buf)[itm.inreg[3]:itm.inreg[3] + 1]
+            if t[j] & (1 << 7):
+                _at(t, j, wdcsr + (bt_csr >> 3))
+                t[j] |= bt_csr & 7
+                bt_csr += t[j + 2]
             else:
                 # Non-binary items
-                itm.inreg[3] = wdcsr + 1 if bt_csr > 0 else wdcsr # if the bits are not aligned
-                wdcsr += (2 ** ((itm.inreg[0] >> 5) & 0b11)) * itm.inreg[2]
-                itm.memref = memoryview(self.buf)[itm.inreg[3]:itm.inreg[3] + itm.inreg[2] * (1 << ((itm.inreg[0] >> 5) & 0b11))]
+                wdcsr += (bt_csr + 7) >> 3 # if the bits are not aligned
+                bt_csr = 0
+                _at(t, j, wdcsr)
+                wdcsr += self._isz(j >> 2)
+
+def _flush(regs):
+    """
+        Writes the changes of many registers with as few writes as possible: for each memory, changes next to each
+        other, or only separated by bytes one of the registers holds, are written in a single slice
+    """
+    t = _TM() if _TM else 0
+    grp, w0 = {}, {}
+    for r in _expand(regs):
+        if type(r).post_all is not Mem.post_all and not isinstance(r, RegisterBank):
+            r.post_all() # registers with their own way of writing
+            continue
+        g = grp.get(id(r.mem))
+        if g is None:
+            g = grp[id(r.mem)] = (r.mem, [], [])
+        g[1].append(r)
+        g[2].extend((r.memstart + a, r.memstart + b, r) for a, b in r._runs())
+        w0[id(r)] = r.written
+    for mem, rl, dl in grp.values():
+        dl.sort(key=lambda d: d[0])
+        i = 0
+        while i < len(dl):
+            s, e = dl[i][0], dl[i][1]
+            j = i + 1
+            while j < len(dl) and _covered(rl, e, dl[j][0]):
+                e = max(e, dl[j][1])
+                j += 1
+            chk = bytearray(e - s)
+            for r in rl: # bytes between the changes
+                a, b = max(s, r.memstart), min(e, r.memstart + r.span)
+                if a < b:
+                    chk[a - s:b - s] = memoryview(r.buf)[a - r.memstart:b - r.memstart]
+            for a, b, r in dl[i:j]: # the changes themselves
+                chk[a - s:b - s] = memoryview(r.buf)[a - r.memstart:b - r.memstart]
+            mem[s:e] = chk
+            for r in rl:
+                r.written += max(0, min(e, r.memstart + r.span) - max(s, r.memstart))
+            i = j
+        for r in rl:
+            if r.check:
+                e = r.memstart + r.span
+                r._sum([(max(a, r.memstart) - r.memstart, min(b, e) - r.memstart) for a, b, _ in dl if a < e and b > r.memstart])
+            r._clean()
+            _done(r, 0, r.written - w0[id(r)], t) if _ST is not None else None
+            r.ld_buf() if r.reload else None
+
+def _expand(regs):
+    # adds the registers of the banks, and the banks with checksums of the registers so their tables follow
+    r = list(regs)
+    for x in regs:
+        b = getattr(x, '_bk', None)
+        if b is not None and b.check and b not in r:
+            r.append(b)
+    for b in tuple(r):
+        if isinstance(b, RegisterBank):
+            r.extend(x for x in b.regs if x not in r)
+    return r
+
+def _covered(regs, a, b):
+    # True if the bytes a to b of a memory are all held by the registers
+    while a < b:
+        for r in regs:
+            if r.memstart <= a < r.memstart + r.span:
+                a = r.memstart + r.span
+                break
+        else:
+            return False
+    return True
+
+class Transaction:
+    """
+    Changes many registers at once. When the with block ends, their changes are written with as few writes as possible
+    for each memory they share. If an exception is raised in the block, their buffers are put back as they were when
+    it started and nothing is written.
+    """
+    def __init__(self, *regs):
+        self.regs = _expand(regs)
+        self._sav = None
+
+    def __enter__(self):
+        self._sav = [(bytes(r.buf), bytes(r._dm)) for r in self.regs]
+        return self
+
+    def __exit__(self, et, ev, tb):
+        if et is None:
+            _flush(self.regs)
+        else:
+            for r, (b, d) in zip(self.regs, self._sav):
+                r.buf[:] = b
+                r._dm[:] = d
+        self._sav = None
+        return False
+
+def transaction(*regs):
+    """
+        with memregs.transaction(header, register):
+            header['DATE'] = time.time()
+            register.toggle('STATUS')
+    """
+    return Transaction(*regs)
+
+class RegisterBank(Mem):
+    """
+    One buffer for many registers laid in the same region of a memory. The registers are views on the bank's buffer, so
+    they don't have their own, the whole region is loaded with a single read and flushed with as few writes as possible.
+    With check, the checksums cover the whole bank, its registers can't have their own.
+    """
+    def __init__(self, name, mem, offset, span, auto_ld=True, check=0):
+        self.regs = []
+        super().__init__(name, mem, offset, span, auto_ld, check=check)
+
+    def add(self, cls, name, offset, *args, **kwargs):
+        """
+            Makes a register of class cls at offset in the bank, the other arguments are the ones of cls
+            header = bank.add(memregs.Pack, 'HEADER', 0, ('INITD', 1, True), ('DATE', 1, False, 'H'), span=16)
+        """
+        span = kwargs.get('span')
+        if span is None and issubclass(cls, Register): # a Register knows its span once its class is laid out
+            cls._lay() if cls._own is not cls else None
+            span = cls.span
+        span = span or 32
+        if kwargs.get('check'):
+            raise ValueError(f"{name}: registers of a bank can't have their own checksums, give check to the bank")
+        if offset < 0 or offset + span > self.span:
+            raise ValueError(f"{name} doesn't fit in {self.name}")
+        for r in self.regs:
+            o = r.memstart - self.memstart
+            if offset < o + r.span and o < offset + span:
+                raise ValueError(f"{name} overlaps {r.name}")
+        r = cls(name, self.mem, self.memstart + offset, *args, buf=memoryview(self.buf)[offset:offset + span], **kwargs)
+        r._bk = self
+        self.regs.append(r)
+        return r
+
+    def __getitem__(self, nm):
+        for r in self.regs:
+            if r.name == nm:
+                return r
+        raise KeyError(nm)
+
+    def post_all(self):
+        _flush((self,))
+
+    def ld_buf(self):
+        Mem.ld_buf(self)
+        for r in self.regs:
+            r._clean()
+
+class RecordStore(Mem):
+    """
+    Log of fixed size records in a region of memory, like events or readings kept in RTC memory between wakes.
+    The records are laid like the items of a Pack: ('NAME', length, bin = False, format = 'B').
+    Region: head (H) and count (H), then the records. append() writes one record and the header, when the store is
+    full the oldest record is overwritten. Records are decoded many at once with the layout's struct format repeated.
+    """
+    def __init__(self, name, mem, offset, *args, span=32, layout=None, buf=None, direct=False):
+        self.rec = Pack(name, mem, 0, *args, span=0, layout=layout, buf=bytearray(0)) # only its layout is used
+        self.rec._compile()
+        if any(e[2] < 0 for e in self.rec._ents.values()):
+            raise ValueError('records cannot hold rings')
+        self.rsz = struct.calcsize(self.rec._fmt)
+        self.cap = (span - 4) // self.rsz
+        if self.cap < 1:
+            raise ValueError(f"{name} is too small for one record")
+        super().__init__(name, mem, offset, span, buf is None, buf, direct)
+        self._zero = self.rec._unpack(bytes(self.rsz)) # values of an empty record
+
+    def _u16(self, o):
+        return self.buf[o] | self.buf[o + 1] << 8
+
+    def _head(self):
+        h = self._u16(0)
+        return h if h < self.cap else 0
+
+    def __len__(self):
+        n = self._u16(2)
+        return n if n <= self.cap else 0
+
+    def _hdr(self, h, n):
+        b = self.buf
+        b[0], b[1], b[2], b[3] = h & 0xFF, h >> 8, n & 0xFF, n >> 8
+        self._mark(0, 4)
+
+    def append(self, **fields):
+        """ Adds a record, the items not given are zero """
+        _cnt(self.name, 1, len(fields)) if _ST is not None else None
+        h, n = self._head(), len(self)
+        o = 4 + h * self.rsz
+        self.rec._pack(list(self._zero), fields, self.buf, o)
+        self._mark(o, o + self.rsz)
+        self._hdr(h + 1 if h + 1 < self.cap else 0, n + 1 if n < self.cap else n)
+
+    def clear(self):
+        self._hdr(0, 0)
+
+    def _read(self, i, k):
+        # k records from the i-th oldest, read with one struct call per contiguous part of the ring
+        s = (self._head() - len(self) + i) % self.cap
+        r = []
+        while k:
+            c = min(k, self.cap - s)
+            v, nv = self.rec._unpack(self.buf, 4 + s * self.rsz, c), len(self._zero)
+            r.extend(self.rec._vals(v, j * nv) for j in range(c))
+            k, s = k - c, 0
+        _cnt(self.name, 0, len(r)) if _ST is not None else None
+        return r
+
+    def __getitem__(self, i):
+        # i-th oldest record, -1 is the newest
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('record index out of range')
+        return self._read(i, 1)[0]
+
+    def records(self, start=0, n=None):
+        """ List of n records (all by default) from the start-th oldest """
+        m = len(self) - start
+        return self._read(start, m if n is None or n > m else n) if m > 0 else []
+
+    def __iter__(self):
+        # records from the oldest, decoded in batches of 16
+        n, i = len(self), 0
+        while i < n:
+            for r in self._read(i, min(16, n - i)):
+                yield r
+            i += 16
+
+    def drain(self):
+        """ Returns all the records and empties the store """
+        r = self.records()
+        self.clear()
+        return r
+
+class RegisterFile:
+    """
+    Block of 32 bits hardware registers with bit fields, like the registers of a peripheral. A word is read from mem the
+    first time it is used, and post_all() only writes back the words that changed, in address order.
+    regs: ('NAME', byte offset, flags, *fields) with flags 'rw', 'r' (read only) or 'w' (write only)
+    fields: ('FIELD', position, span) like IndexBinStruct, read and written with rf['NAME.FIELD'], rf['NAME'] is the word
+    """
+    def __init__(self, name, base, *regs, mem=None):
+        if mem is None:
+            from machine import mem32 as mem
+        self.name, self.mem, self.base = name, mem, base
+        regs = sorted(regs, key=lambda r: r[1])
+        n = len(regs)
+        self.adr = [base + r[1] for r in regs]
+        self.fl = bytearray(n) # bit 0: readable, bit 1: writable
+        self.w = [0] * n
+        self._ok = bytearray((n + 7) >> 3) # words read from mem, one bit each
+        self._dw = bytearray((n + 7) >> 3) # words to write back
+        self.written = 0
+        self.keys = {} # key: (word, position, mask)
+        for i, r in enumerate(regs):
+            if r[1] & 3:
+                raise ValueError(f"{r[0]} is not aligned on a word")
+            self.fl[i] = ('r' in r[2]) | ('w' in r[2]) << 1
+            self.keys[r[0]] = (i, 0, 0xFFFFFFFF)
+            for f in r[3:]:
+                self.keys[r[0] + '.' + f[0]] = (i, f[1], (1 << f[2]) - 1)
+
+    def _word(self, i):
+        if not self._ok[i >> 3] & (1 << (i & 7)):
+            if self.fl[i] & 1:
+                self.w[i] = self.mem[self.adr[i]]
+                _cnt(self.name, 5, 4) if _ST is not None else None
+            self._ok[i >> 3] |= 1 << (i & 7)
+        return self.w[i]
+
+    def __getitem__(self, k):
+        i, p, m = self.keys[k]
+        if not self.fl[i] & 1:
+            raise AttributeError(k + ' is write only')
+        _cnt(self.name, 0) if _ST is not None else None
+        return (self._word(i) >> p) & m
+
+    def __setitem__(self, k, v):
+        i, p, m = self.keys[k]
+        if not self.fl[i] & 2:
+            raise AttributeError(k + ' is read only')
+        _cnt(self.name, 1) if _ST is not None else None
+        if m == 0xFFFFFFFF: # whole word, no need to read it
+            self._ok[i >> 3] |= 1 << (i & 7)
+            self.w[i] = v & m
+        else:
+            # write only registers keep the last value written
+            self.w[i] = self._word(i) & ~(m << p) | (int(v) & m) << p
+        self._dw[i >> 3] |= 1 << (i & 7)
+
+    @property
+    def dirty(self):
+        return any(self._dw)
+
+    def post_all(self):
+        """ Writes the words that changed, in address order """
+        t, n = _TM() if _TM else 0, 0
+        dw = self._dw
+        for i in range(len(self.w)):
+            if dw[i >> 3] & (1 << (i & 7)):
+                self.mem[self.adr[i]] = self.w[i]
+                n += 4
+        for j in range(len(dw)):
+            dw[j] = 0
+        self.written += n
+        _done(self, 0, n, t) if _ST is not None else None
+
+    def ld_buf(self):
+        """ Forgets the words read and the changes, each word is read again the next time it is used """
+        t = _TM() if _TM else 0
+        for j in range(len(self._ok)):
+            self._ok[j] = self._dw[j] = 0
+        _done(self, 1, 0, t) if _ST is not None else None
+
+_fc = 0 # fields made so far, keeps them in the order they are declared
+
+class Field:
+    """ Field of a Register, read and written straight in the register's buffer. c is its struct format """
+    __slots__ = ('i', 'c', 'fmt', 'n', 'sz', 'off', 'pos', 'mask')
+    C = 'B'
+
+    def __init__(self, n=1):
+        global _fc
+        self.i, _fc = _fc, _fc + 1
+        self.c, self.n = self.C, n
+        self.fmt = '<' + self.C
+        self.sz = struct.calcsize(self.fmt) * n
+        self.off, self.pos, self.mask = 0, 0, 0
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        _cnt(obj.name, 0) if _ST is not None else None
+        return struct.unpack_from(self.fmt, obj.buf, self.off)[0]
+
+    def __set__(self, obj, v):
+        _cnt(obj.name, 1) if _ST is not None else None
+        struct.pack_into(self.fmt, obj.buf, self.off, v)
+        obj._mark(self.off, self.off + self.sz)
+
+class U8(Field):
+    __slots__ = ()
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        _cnt(obj.name, 0) if _ST is not None else None
+        return obj.buf[self.off]
+
+    def __set__(self, obj, v):
+        _cnt(obj.name, 1) if _ST is not None else None
+        obj.buf[self.off] = v & 0xFF
+        obj._mark(self.off, self.off + 1)
+
+class I8(Field): __slots__ = (); C = 'b'
+class U16(Field): __slots__ = (); C = 'H'
+class I16(Field): __slots__ = (); C = 'h'
+class U32(Field): __slots__ = (); C = 'I'
+class I32(Field): __slots__ = (); C = 'i'
+class F32(Field): __slots__ = (); C = 'f'
+class F64(Field): __slots__ = (); C = 'd'
+
+class Bit(Field):
+    """ Bit field of n bits (up to 32), the bit fields declared one after the other share their bytes """
+    __slots__ = ()
+    def __init__(self, n=1):
+        if not 0 < n <= 32:
+            raise ValueError('bit fields are 1 to 32 bits long')
+        super().__init__(n)
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        _cnt(obj.name, 0) if _ST is not None else None
+        b, o = obj.buf, self.off
+        if self.sz == 1:
+            return (b[o] & self.mask) >> self.pos
+        v = 0
+        for k in range(o + self.sz - 1, o - 1, -1):
+            v = v << 8 | b[k]
+        return (v & self.mask) >> self.pos
+
+    def __set__(self, obj, v):
+        _cnt(obj.name, 1) if _ST is not None else None
+        b, o, m = obj.buf, self.off, self.mask
+        v = ((1 if v else 0) if self.n == 1 else int(v)) << self.pos & m
+        if self.sz == 1:
+            b[o] = b[o] & ~m | v
+        else:
+            for k in range(o, o + self.sz):
+                b[k] = b[k] & ~m | v & 0xFF
+                m >>= 8
+                v >>= 8
+        obj._mark(o, o + self.sz)
+
+class Bytes(Field):
+    """ n raw bytes, shorter values are padded with zeros """
+    __slots__ = ()
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        _cnt(obj.name, 0) if _ST is not None else None
+        return bytes(memoryview(obj.buf)[self.off:self.off + self.n])
+
+    def __set__(self, obj, v):
+        _cnt(obj.name, 1) if _ST is not None else None
+        v = v.encode() if isinstance(v, str) else v
+        b, o, n = obj.buf, self.off, min(len(v), self.n)
+        b[o:o + n] = v[:n]
+        for k in range(o + n, o + self.n):
+            b[k] = 0
+        obj._mark(o, o + self.n)
+
+class Register(Mem):
+    """
+    Register declared as a class. The fields are laid once per class, in the order they are declared, bit fields are
+    packed together and the other fields start on the next byte:
+        class Header(memregs.Register):
+            initd = memregs.Bit()
+            mode = memregs.Bit(3)
+            date = memregs.U32()
+            name = memregs.Bytes(8)
+        hdr = Header('HEADER', memory, 0)
+        hdr.date = time.time()
+    Set span in the class to keep more bytes than the fields need.
+    """
+    span = 0
+    fields = ()
+    _own = None # class the layout was made for
+
+    def __init__(self, name, mem, offset, span=None, buf=None, direct=False):
+        cls = type(self)
+        if cls._own is not cls:
+            cls._lay()
+        span = span or (len(buf) if buf is not None else cls.span)
+        if span < cls.span:
+            raise ValueError(f"{name} needs {cls.span} bytes")
+        super().__init__(name, mem, offset, span, buf is None, buf, direct)
+
+    @classmethod
+    def _lay(cls):
+        fs = []
+        # names the register uses itself: its class' attributes and the ones Mem sets on every instance
+        used = set(dir(Register)) | set(Mem('', b'', 0, 1, False, check=1).__dict__)
+        for k in dir(cls):
+            f = getattr(cls, k)
+            if isinstance(f, Field):
+                if k in used:
+                    raise ValueError(k + ' is used by the register itself, rename the field')
+                fs.append((f.i, k, f))
+        fs.sort()
+        bc = 0 # bit cursor
+        for _, _, f in fs:
+            if isinstance(f, Bit):
+                f.off, f.pos = bc >> 3, bc & 7
+                f.sz = (f.pos + f.n + 7) >> 3
+                f.mask = ((1 << f.n) - 1) << f.pos
+                bc += f.n
+            else:
+                f.off = (bc + 7) >> 3
+                bc = (f.off + f.sz) << 3
+        cls.fields = tuple(k for _, k, _ in fs)
+        cls.span = max(cls.span, (bc + 7) >> 3)
+        cls._own = cls
+
+    def snapshot(self):
+        """ Returns a dict with the values of all the fields """
+        return {k: getattr(self, k) for k in self.fields}
+
+    def update(self, **fields):
+        for k, v in fields.items():
+            setattr(self, k, v)
+
+    def __str__(self):
+        return '\n'.join(k + ": " + str(getattr(self, k)) for k in self.fields)
 
 if __name__ == "__main__":
     import os
@@ -0,0 +1,97 @@
+"""
+Tests for memasync on CPython's asyncio, run with pytest from the Memregs folder.
+"""
+import asyncio, time
+import pytest
+import memregs, memasync
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(memregs, 'CACHE', memregs.RegCache(str(tmp_path / 'memcache.bin')))
+
+class SlowMem(bytearray):
+    """ bytearray taking 5 ms per slice written, like a flash page, fails while fail is set """
+    writes = 0
+    fail = False
+
+    def __setitem__(self, k, v):
+        if isinstance(k, slice):
+            if self.fail:
+                raise OSError('write failed')
+            time.sleep(0.005)
+            self.writes += 1
+        bytearray.__setitem__(self, k, v)
+
+def _regs(mem):
+    a = memregs.Pack('A', mem, 0, ('X', 1, False, 'H'), span=8)
+    b = memregs.Pack('B', mem, 8, ('Y', 1, False, 'H'), span=8)
+    return a, b
+
+def test_burst_is_written_once(cache):
+    async def main():
+        mem = SlowMem(64)
+        wb = memasync.WriteBehind(delay=40, limit=1000)
+        a, b = (wb.add(r) for r in _regs(mem))
+        for i in range(10):
+            a['X'], b['Y'] = i, 100 + i
+            a.post_all(); b.post_all()
+            await asyncio.sleep(0.005)
+        assert mem.writes == 0 and mem[0] == 0
+        await asyncio.sleep(0.1)
+        assert (mem.writes, wb.writes) == (1, 1) # both registers in one slice
+        assert (mem[0], mem[8]) == (9, 109)
+        wb.close()
+    asyncio.run(main())
+
+def test_limit_bounds_the_delay(cache):
+    async def main():
+        mem = SlowMem(64)
+        wb = memasync.WriteBehind(delay=50, limit=100)
+        a = wb.add(_regs(mem)[0])
+        for i in range(20): # never 50 ms without a post_all()
+            a['X'] = i
+            a.post_all()
+            await asyncio.sleep(0.02)
+        assert wb.writes >= 2
+        wb.close()
+        assert mem[0] == 19
+    asyncio.run(main())
+
+def test_flush_and_sync_write_now(cache):
+    async def main():
+        mem = SlowMem(64)
+        wb = memasync.WriteBehind(delay=10000, limit=10000)
+        a, b = (wb.add(r) for r in _regs(mem))
+        a['X'], b['Y'] = 1, 2
+        a.post_all(); b.post_all()
+        await a.flush()
+        assert (mem[0], mem[8], wb._due) == (1, 0, [b])
+        wb.sync()
+        assert (mem[8], wb._due, wb.writes) == (2, [], 2)
+        wb.close()
+    asyncio.run(main())
+
+def test_failed_write_is_tried_again(cache):
+    async def main():
+        mem = SlowMem(64)
+        wb = memasync.WriteBehind(delay=20, limit=100)
+        a = wb.add(_regs(mem)[0])
+        mem.fail = True
+        a['X'] = 5
+        a.post_all()
+        await asyncio.sleep(0.06)
+        assert isinstance(wb.error, OSError) and wb._due == [a] and wb.writes == 0
+        mem.fail = False
+        a.post_all()
+        await asyncio.sleep(0.06)
+        assert mem[0] == 5 and wb._due == [] and wb.writes == 1
+        wb.close()
+    asyncio.run(main())
+
+def test_without_loop_writes_at_once(cache):
+    mem = SlowMem(64)
+    wb = memasync.WriteBehind()
+    a = wb.add(_regs(mem)[0])
+    a['X'] = 3
+    a.post_all()
+    assert mem[0] == 3 and wb.writes == 1
@@ -0,0 +1,50 @@
+"""
+Tests for memlog on CPython with FileFlash, run with pytest from the Memregs folder.
+"""
+import random
+import pytest
+import memregs, memlog
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(memregs, 'CACHE', memregs.RegCache(str(tmp_path / 'memcache.bin')))
+
+def _pack(mem):
+    return memregs.Pack('CFG', mem, 0, ('INITD', 1, True), ('COUNT', 1, False, 'I'), ('NAME', 8), span=32)
+
+def test_replay_after_remount(cache, tmp_path):
+    fnm = str(tmp_path / 'flash.bin')
+    p = _pack(memlog.LogMem(memlog.FileFlash(fnm, 4, 256), 32))
+    for i in range(1, 60): # fills a few pages
+        p['COUNT'] = i
+        p['INITD'] = i & 1
+        p.post_all()
+    p['NAME'] = b'sensor'
+    p.post_all()
+    q = _pack(memlog.LogMem(memlog.FileFlash(fnm, 4, 256), 32))
+    assert (q['COUNT'].value, q['INITD'].value, bytes(q['NAME'].value)) == (59, 1, b'sensor\0\0')
+
+def test_torn_record_is_dropped(tmp_path):
+    fnm = str(tmp_path / 'flash.bin')
+    fl = memlog.FileFlash(fnm, 4, 256)
+    lm = memlog.LogMem(fl, 32)
+    lm[0:4] = b'good'
+    page, pos = lm.page, lm.pos
+    fl.writeblocks(page, b'torn', pos + 4) # power lost after the data, before the header
+    lm = memlog.LogMem(memlog.FileFlash(fnm, 4, 256), 32)
+    assert bytes(lm[0:4]) == b'good' and lm.page == (page + 1) % 4 # moved to a clean page
+    lm[4:8] = b'next'
+    lm = memlog.LogMem(memlog.FileFlash(fnm, 4, 256), 32)
+    assert bytes(lm[0:8]) == b'goodnext'
+
+def test_erases_spread_over_pages(tmp_path):
+    fl, rnd = memlog.FileFlash(str(tmp_path / 'flash.bin'), 6, 256), random.Random(5)
+    lm = memlog.LogMem(fl, 40)
+    ref = bytearray(40)
+    for _ in range(2000):
+        a = rnd.randrange(36)
+        v = bytes(rnd.randrange(256) for _ in range(4))
+        lm[a:a + 4], ref[a:a + 4] = v, v
+    assert bytes(lm[:]) == ref
+    assert min(fl.erases) > 10 and max(fl.erases) - min(fl.erases) <= 1
+    assert bytes(memlog.LogMem(fl, 40)[:]) == ref
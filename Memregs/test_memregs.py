@@ -0,0 +1,292 @@
+"""
+Tests for memregs on CPython, run with pytest from the Memregs folder. hostuctypes stands in for uctypes.
+"""
+import os, subprocess, sys, tracemalloc
+import pytest
+import memregs
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    c = memregs.RegCache(str(tmp_path / 'memcache.bin'))
+    monkeypatch.setattr(memregs, 'CACHE', c)
+    return c
+
+def test_cache_keeps_negative_values(cache):
+    cache.push('X', {'A': -1069547520, 'B': (5, -1073741824), 'C': 1}, 7)
+    assert memregs.RegCache(cache.fnm).get('X', 7) == {'A': -1069547520, 'B': (5, -1073741824), 'C': 1}
+
+def test_struct_warm_cache(cache):
+    items = (('A', 1, True), ('T', 8, 'ARRAY'), ('D', 1, 'UINT32'), ('S', 1, 'INT16'))
+    cold = memregs.Struct('S', bytearray(64), 0, *items, span=32)
+    memregs.CACHE = memregs.RegCache(cache.fnm)
+    warm = memregs.Struct('S', bytearray(64), 0, *items, span=32)
+    assert warm.layout == cold.layout
+    warm['A'], warm['D'], warm['S'] = 1, 7, -3
+    assert (warm['A'], warm['D'], warm['S']) == (1, 7, -3)
+
+def test_pack_warm_cache(cache):
+    items = (('F', 1, True), ('G', 3, True), ('W', 1, False, 'I'))
+    cold = memregs.Pack('P', bytearray(32), 0, *items, span=16)
+    memregs.CACHE = memregs.RegCache(cache.fnm)
+    warm = memregs.Pack('P', bytearray(32), 0, *items, span=16)
+    assert warm._tb == cold._tb
+
+def test_cache_appends(cache, monkeypatch):
+    modes = []
+    def spy(f, mode='r'):
+        modes.append(mode)
+        return open(f, mode)
+    monkeypatch.setattr(memregs, 'open', spy, raising=False)
+    for i in range(40):
+        cache.push('R%d' % i, {'A': i, 'B': (i, -i)}, i)
+    assert cache._end > 512 and [m for m in modes if m != 'rb'] == ['wb'] + ['r+b'] * 39
+    del modes[:]
+    for i in range(200):
+        cache.push('R0', {'A': i}, 100 + i) # replaced records are dropped once they take most of the file
+    assert 'wb' in modes
+    c = memregs.RegCache(cache.fnm)
+    assert c.get('R0', 299) == {'A': 199} and c.get('R39', 39) == {'A': 39, 'B': (39, -39)}
+
+def test_bank_registers_have_no_checksums(cache):
+    bank = memregs.RegisterBank('BANK', bytearray(128), 0, 64, check=16)
+    with pytest.raises(ValueError):
+        bank.add(memregs.Pack, 'A', 0, ('X', 1, False, 'H'), span=16, check=8)
+    a = bank.add(memregs.Pack, 'A', 0, ('X', 1, False, 'H'), span=16)
+    b = bank.add(memregs.Pack, 'B', 16, ('Y', 1, False, 'H'), span=16)
+    a['X'], b['Y'] = 1234, 4321
+    bank.post_all()
+    bank.ld_buf()
+    assert bank.valid and (a['X'].value, b['Y'].value) == (1234, 4321)
+
+def test_pack_length_limits(cache):
+    with pytest.raises(ValueError):
+        memregs.Pack('BIG', bytearray(512), 0, ('BIG', 300), span=400)
+    p = memregs.Pack('BIG', bytearray(512), 0, ('OK', 255), ('HIST', 300, False, 'RING:B'), span=400)
+    assert p._isz(p._ix['OK']) == 255
+
+def test_update_single_byte(cache):
+    p = memregs.Pack('UPD', bytearray(32), 0, ('REFRESH', 1), ('NAME', 4), ('DATE', 1, False, 'H'), span=16)
+    p.update(REFRESH=4, NAME='ab', DATE=300)
+    assert p.snapshot() == {'REFRESH': b'\x04', 'NAME': b'ab\0\0', 'DATE': 300}
+    rs = memregs.RecordStore('EVS', bytearray(64), 0, ('EV', 1), ('T', 1, False, 'H'), span=32)
+    rs.append(EV=7, T=5)
+    assert rs[-1] == {'EV': b'\x07', 'T': 5}
+
+@pytest.mark.parametrize('nm', ['seq', 'check', 'valid', 'irq', 'reload', 'buf', 'post_all', 'fields'])
+def test_register_reserved_names(nm):
+    cls = type('R_' + nm, (memregs.Register,), {'ok': memregs.U16(), nm: memregs.Bit()})
+    with pytest.raises(ValueError):
+        cls('R', bytearray(16), 0)
+
+def test_register_fields():
+    class R(memregs.Register):
+        flag = memregs.Bit()
+        date = memregs.U32()
+    r = R('R', bytearray(16), 0)
+    r.flag, r.date = 1, 123456
+    r.post_all()
+    assert R('R', r.mem, 0).snapshot() == {'flag': 1, 'date': 123456}
+
+def test_cache_hit_across_hash_seeds(tmp_path):
+    # the layout fingerprint mustn't depend on hash(), which changes from one interpreter to the next
+    run = """if 1:
+        import memregs
+        memregs.CACHE = memregs.RegCache(%r)
+        memregs.enable_stats()
+        memregs.Pack('P', bytearray(64), 0, ('F', 1, True), ('D', 1, False, 'I'), ('N', 8), span=32)
+        memregs.Struct('S', bytearray(64), 0, ('F', 1, True), ('T', 8, 'ARRAY'), span=32)
+        c = memregs.stats()['*CACHE']
+        print(c['hits'], c['misses'])
+    """ % str(tmp_path / 'memcache.bin')
+    out = []
+    for seed in ('1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        out.append(subprocess.run([sys.executable, '-c', run], env=env, cwd=os.path.dirname(memregs.__file__),
+                                  capture_output=True, text=True, check=True).stdout.split())
+    assert out == [['0', '2'], ['2', '0']] # (hits, misses): all misses, then all hits
+
+def _alloc(fn):
+    for _ in range(100): # warm up, CPython allocates while it specializes the code of the first calls
+        fn()
+    tracemalloc.start()
+    fn()
+    base = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - base
+
+def test_irq_mode_does_not_allocate(cache):
+    # values (shifted in place for bit fields) stay under 256: CPython caches these ints, like micropython's small ints
+    p = memregs.Pack('IRQ', bytearray(64), 8, ('F', 1, True), ('M', 3, True), ('W', 12, True), ('C', 1, False, 'H'),
+                     ('D', 1, False, 'I'), span=24, irq=True)
+    f, m, w, c, d = (p[k] for k in 'FMWCD')
+    def get():
+        f.value; m.value; w.value; c.value; d.value; p['D'].value
+    def set():
+        m.ch_val(5); w.ch_val(10); c.ch_val(250); d.ch_val(123); p['M'] = 3
+    def post():
+        f.toggle(); c.ch_val(7); p.post_all()
+    ops = {'get': get, 'set': set, 'toggle': f.toggle, 'post_all': post, 'ld_buf': p.ld_buf}
+    assert {k: _alloc(fn) for k, fn in ops.items()} == dict.fromkeys(ops, 0)
+    assert (m.value, w.value, c.value, d.value) == (3, 10, 7, 123)
+
+def test_struct_array_read_is_clean(cache):
+    mem = bytearray(64)
+    s = memregs.Struct('S', mem, 0, ('F', 1, True), ('T', 8, 'ARRAY'), ('D', 1, 'UINT32'), span=32)
+    bytes(s['T'])
+    assert not s.dirty
+    s['T'][2] = 7
+    s.touch('T')
+    assert list(s._runs()) == [(1, 9)]
+    s.post_all()
+    assert mem[3] == 7 and not s.dirty
+
+def test_struct_put_refuses_long_values(cache):
+    s = memregs.Struct('S', bytearray(64), 0, ('T', 8, 'ARRAY'), ('W', 4, 'ARRAY:UINT16'), span=32)
+    s['T'], s['W'] = b'12345678', [1, 2, 3, 4]
+    for k, v in (('T', b'123456789'), ('T', 'x' * 9), ('W', [1, 2, 3, 4, 5])):
+        with pytest.raises(ValueError):
+            s[k] = v
+    assert bytes(s['T']) == b'12345678' and list(s['W']) == [1, 2, 3, 4]
+
+def test_mark_ranges(cache):
+    p = memregs.Pack('MK', bytearray(64), 0, ('F', 1, True), ('D', 1, False, 'I'), ('N', 20), span=40)
+    for a in range(40):
+        for b in range(a, 41):
+            p._clean()
+            p._mark(a, b)
+            assert list(p._runs()) == ([(a, b)] if a < b else [])
+    p._clean()
+    p['D'] = 1234
+    p['F'] = 1
+    p['N'] = b'x'
+    assert list(p._runs()) == [(0, 25)]
+
+def test_bank_register_post_keeps_checksums(cache):
+    mem = bytearray(128)
+    bank = memregs.RegisterBank('BANK', mem, 0, 64, check=16)
+    a = bank.add(memregs.Pack, 'A', 0, ('X', 1, False, 'H'), span=8)
+    b = bank.add(memregs.Pack, 'B', 8, ('Y', 1, False, 'H'), span=8)
+    bank.post_all()
+    a['X'], b['Y'] = 5, 6 # same block, b isn't posted but the table must match what's in mem
+    a.post_all()
+    again = memregs.RegisterBank('BANK', mem, 0, 64, check=16)
+    assert again.valid and mem[0] == 5 and not a.dirty
+    again.add(memregs.Pack, 'A', 0, ('X', 1, False, 'H'), span=8)['X'] = 9
+    memregs._flush([again['A']]) # like WriteBehind does
+    assert memregs.RegisterBank('BANK', mem, 0, 64, check=16).valid
+
+def test_record_store(cache):
+    mem = bytearray(8192)
+    rs = memregs.RecordStore('EVS', mem, 0, ('EV', 1, False, 'H'), ('OK', 1, True), span=8192)
+    assert len(rs.rec.buf) == 0 and len(rs.rec._dm) == 0 # the template only holds the layout
+    for i in range(rs.cap + 10):
+        rs.append(EV=i, OK=i & 1)
+    assert len(rs) == rs.cap and rs[0] == {'EV': 10, 'OK': 0} and rs[-1] == {'EV': rs.cap + 9, 'OK': (rs.cap + 9) & 1}
+
+def test_register_in_bank():
+    class H(memregs.Register):
+        flag = memregs.Bit()
+        date = memregs.U32()
+        mode = memregs.U16()
+    bank = memregs.RegisterBank('B', bytearray(32), 0, 16)
+    h = bank.add(H, 'H', 0)
+    assert h.span == H.span == 7
+    h.date = 42
+    bank.post_all()
+    assert H('H', bank.mem, 0).date == 42 and len(h.__dict__) < 10 # the Mem defaults stay in the class
+
+class SpyMem(bytearray):
+    """ bytearray counting the slices written to it """
+    writes = 0
+
+    def __setitem__(self, k, v):
+        self.writes += isinstance(k, slice)
+        bytearray.__setitem__(self, k, v)
+
+def test_transaction_writes_once_and_rolls_back(cache):
+    mem = SpyMem(64)
+    a = memregs.Pack('A', mem, 0, ('X', 1, False, 'H'), ('Y', 1, False, 'H'), span=8)
+    b = memregs.Pack('B', mem, 8, ('Z', 1, False, 'H'), span=8)
+    with memregs.transaction(a, b):
+        a['X'], b['Z'] = 1, 2
+    assert mem.writes == 1 and mem[0] == 1 and mem[8] == 2 and not a.dirty and not b.dirty
+    with pytest.raises(KeyError):
+        with memregs.transaction(a, b):
+            a['Y'], b['Z'] = 7, 9
+            b['NOPE']
+    assert mem.writes == 1 and (a['Y'].value, b['Z'].value) == (0, 2) and not a.dirty and not b.dirty
+
+def test_flush_counts_bytes_out(cache):
+    memregs.enable_stats()
+    try:
+        bank = memregs.RegisterBank('BK', bytearray(64), 0, 32)
+        r = bank.add(memregs.Pack, 'R', 0, ('D', 1, False, 'I'), span=8)
+        memregs.stats(reset=True)
+        r['D'] = 5
+        bank.post_all()
+        assert r.written == 4 and memregs.stats()['R']['bytes_out'] == 4
+    finally:
+        memregs.disable_stats()
+
+@pytest.mark.parametrize('timer', [None, lambda: 7])
+def test_stats_hook(cache, timer):
+    calls = []
+    memregs.enable_stats(timer=timer, hook=lambda *a: calls.append(a))
+    try:
+        p = memregs.Pack('H', bytearray(16), 0, ('X', 1, False, 'H'), span=8)
+        p['X'] = 1
+        p.post_all()
+    finally:
+        memregs.disable_stats()
+    assert calls == [('H', 'ld_buf', 0 if timer else None), ('H', 'post_all', 0 if timer else None)]
+
+def test_pack_items_start_in_the_first_256_bytes(cache):
+    for cls in (memregs.Pack, memregs.OrderedPack):
+        with pytest.raises(ValueError, match='first 256 bytes'):
+            cls('R', bytearray(512), 0, ('R', 300, False, 'RING'), ('X', 1), span=400)
+        p = cls('R', bytearray(512), 0, ('X', 1), ('R', 300, False, 'RING'), span=400)
+        p['R'].push(5)
+        assert list(p['R']) == [5]
+
+class FakeMem32:
+    """ machine.mem32 on a dict, logs the reads and writes """
+    def __init__(self, w=None):
+        self.w, self.log = dict(w or {}), []
+
+    def __getitem__(self, a):
+        assert not a & 3
+        self.log.append(('r', a))
+        return self.w.get(a, 0)
+
+    def __setitem__(self, a, v):
+        assert not a & 3
+        self.log.append(('w', a))
+        self.w[a] = v & 0xFFFFFFFF
+
+def test_register_file(cache):
+    mem = FakeMem32({0x100: 0xF0, 0x104: 0b1101})
+    rf = memregs.RegisterFile('RF', 0x100, ('TXD', 0x08, 'w'), ('STATUS', 0x04, 'r', ('RDY', 0, 1), ('ERR', 2, 2)),
+                              ('CTRL', 0x00, 'rw', ('EN', 0, 1), ('MODE', 1, 3)), mem=mem)
+    assert mem.log == [] and not rf.dirty
+    assert (rf['STATUS.RDY'], rf['STATUS.ERR'], rf['STATUS']) == (1, 3, 0b1101)
+    assert mem.log == [('r', 0x104)] # read once, when first used
+    rf['TXD'] = 0x41
+    rf['CTRL.MODE'] = 5
+    rf['CTRL.EN'] = 1
+    assert mem.log == [('r', 0x104), ('r', 0x100)] and rf.dirty # CTRL read for its other bits, TXD never
+    mem.log.clear()
+    rf.post_all()
+    assert mem.log == [('w', 0x100), ('w', 0x108)] and not rf.dirty # only the changed words, in address order
+    assert (mem.w[0x100], mem.w[0x108], rf.written) == (0xFB, 0x41, 8)
+    with pytest.raises(AttributeError):
+        rf['STATUS.RDY'] = 0
+    with pytest.raises(AttributeError):
+        rf['TXD']
+    mem.log.clear()
+    rf.post_all()
+    rf.ld_buf()
+    rf['CTRL']
+    assert mem.log == [('r', 0x100)] # nothing to write, read again after ld_buf
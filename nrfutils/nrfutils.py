@@ -1,4 +1,12 @@
-from machine import mem32
+from array import array
+
+try:
+    from machine import mem32
+    import micropython
+except ImportError:
+    mem32 = None # not on a microcontroller, give SleepMemory a fake mem32 to try it
+    class micropython:
+        native = staticmethod(lambda f: f)
 
 def deepsleep():
     # mem32[0x4002752C]
@@ -28,52 +36,101 @@ def set_sense_pin(p, wake_on_hi=True, twitch = False): # Sorry, I know, not very
     mem32[r] = 0x20004 if wake_on_hi else 0x3000c if not twitch else 0x2000c
 
 class SleepMemory:
-    def __init__(self, ram, sector):
-        self.adr = 0x2000000 + (ram + sector) << 12 if ram < 7 else 0x2001000 + sector << 15
+    """
+    Retained ram sector. sm[a:b] reads and writes any bytes of the sector, so memregs registers can use it as memory and
+    only move the bytes they changed. Everything goes through aligned 32 bits words of mem32, only the words at both ends
+    of a slice are read before being written.
+    """
+    def __init__(self, ram, sector, mem=None):
+        self.m = mem32 if mem is None else mem
+        self.adr = 0x20000000 + ((ram << 1 | sector) << 12) if ram < 8 else 0x20010000 + (sector << 15)
         self.ram = ram
         self.sector = sector
-        self.sz = 0
-        self.mx = 0x1000 if ram < 7 else 0x8000
+        self.mx = 0x1000 if ram < 8 else 0x8000
+
+    def __len__(self):
+        return self.mx
+
+    def _rng(self, key):
+        if isinstance(key, slice):
+            if key.step not in (None, 1):
+                raise TypeError('slices with a step are not supported')
+            a, b = key.start or 0, self.mx if key.stop is None else key.stop
+            a, b = a + self.mx if a < 0 else a, b + self.mx if b < 0 else b
+        else:
+            a = key + self.mx if key < 0 else key
+            b = a + 1
+        if not 0 <= a <= b <= self.mx:
+            raise IndexError('out of the sector')
+        return a, b
+
+    def _rd(self, a, buf):
+        # reads len(buf) bytes from a into buf, one mem32 read per word
+        m, adr, i, n = self.m, self.adr, 0, len(buf)
+        while i < n:
+            s = (a + i) & 3
+            w = m[adr + a + i - s] >> (s << 3)
+            for k in range(i, min(i + 4 - s, n)):
+                buf[k] = w & 0xFF
+                w >>= 8
+            i += 4 - s
+
+    def _wr(self, a, buf):
+        # writes buf at a, one mem32 write per word, partial words are read first
+        m, adr, i, n = self.m, self.adr, 0, len(buf)
+        while i < n:
+            s = (a + i) & 3
+            c = min(4 - s, n - i)
+            o = adr + a + i - s
+            if c == 4:
+                m[o] = buf[i] | buf[i + 1] << 8 | buf[i + 2] << 16 | buf[i + 3] << 24
+            else:
+                w = m[o]
+                for k in range(c):
+                    sh = (s + k) << 3
+                    w = w & ~(0xFF << sh) | buf[i + k] << sh
+                m[o] = w
+            i += c
+
+    def ld(self, a, buf):
+        """ Reads len(buf) bytes from a into buf, without allocating. memregs registers load themselves with it """
+        if not 0 <= a <= a + len(buf) <= self.mx:
+            raise IndexError('out of the sector')
+        self._rd(a, buf)
 
     def __getitem__(self, key):
-        if isinstance(key, slice) and key.start is None and key.stop is None and key.step is None:
-            return self.value
-        raise TypeError('Only full-slice access ([:]) is supported')
+        a, b = self._rng(key)
+        r = bytearray(b - a)
+        self._rd(a, r)
+        return r if isinstance(key, slice) else r[0]
 
     def __setitem__(self, key, val):
-        if isinstance(key, slice) and key.start is None and key.stop is None and key.step is None:
-            self.value = val
-            return
-        raise TypeError('Only full-slice assignment ([:]) is supported')
+        a, b = self._rng(key)
+        if not isinstance(key, slice):
+            val = bytes((val,))
+        elif b - a != len(val):
+            raise ValueError('slice and value must have the same length')
+        self._wr(a, val)
 
     @property
     def value(self):
-        b = bytearray(b''.join(mem32[self.adr + i << 2].to_bytes(4, 'little') for i in range(self.sz)))
-        self.sz = int.from_bytes(b[:2], "little")
-        return b[2:self.sz << 2 - 2]
+        # bytes saved with the setter, the first 2 bytes of the sector are their length
+        h = self[0:2]
+        return self[2:2 + min(h[0] | h[1] << 8, self.mx - 2)]
 
     @value.setter
     def value(self, value):
         if not isinstance(value, (bytes, bytearray)):
             raise TypeError ('Value must be bytes or bytearray')
-        # compute number of 4-byte words and store in self.sz (first 16 bits)
-        self.sz = (len(value)+ 2 + 3) >> 2
-        for chnk in range(self.sz):
-            if chnk == 0:
-                v = int.from_bytes(value[:2], 'little') + (self.sz << 16)
-                st = 0
-            else:
-                st =  2 + (chnk - 1) << 2
-                chunk = value[st:st + 4]
-                if len(chunk) < 4:
-                    chunk = chunk + b'\x00' * (4 - len(chunk))
-                v = int.from_bytes(chunk, 'little')
-            mem32[self.adr + st<<2] = v
+        if len(value) > self.mx - 2:
+            raise ValueError('Value is bigger than the sector')
+        self[0:2] = len(value).to_bytes(2, 'little')
+        self[2:2 + len(value)] = value
 
     def set_retain(self):
-        adr = 0x40000900 + self.ram << 4
+        adr = 0x40000900 + (self.ram << 4)
         sct_on = 1 << (16 + self.sector)
-        mem32[adr] |= sct_on
+        self.m[adr] |= sct_on
 
 def rtcmem(b = None):
     # Only 2 bytes available
@@ -103,35 +160,64 @@ def burnin_uicr(n, val):
         raise OSError('Register not empty, can only write once')
 
 _md = b'\x00\x1f\x1c\x1f\x1e\x1f\x1e\x1f\x1f\x1e\x1f\x1e\x1f'
+_cd = (0, 0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334) # days of the year before each month, not leap
 
 def is_leap(y):
-    return y%4==0 and (y%100 or y%400==0)
+    return y % 4 == 0 and (y % 100 != 0 or y % 400 == 0)
 
 @micropython.native
-def mktime(t):
-    y,m,d,H,M,S = t[:6]
-    days = 365 * y + ((y - 1) >> 2) - (y - 1) // 100 + (y - 1) // 400 - 730484 + sum(_md[:m]) + (m > 2 and is_leap(y)) + d - 1
-    return days * 86400 + H * 3600 + M * 60 + S
+def _mk(t, i):
+    # seconds since 2000 of the time fields t[i:i + 6]
+    y, m = t[i], t[i + 1]
+    y1 = y - 1
+    d = 365 * y + (y1 >> 2) - y1 // 100 + y1 // 400 - 730484 + _cd[m] + (m > 2 and is_leap(y)) + t[i + 2] - 1
+    return d * 86400 + t[i + 3] * 3600 + t[i + 4] * 60 + t[i + 5]
 
 @micropython.native
+def _lt(s, r, i):
+    # writes the localtime fields of s in r[i:i + 8], without loops
+    z = s // 86400
+    s -= z * 86400
+    r[i + 3] = s // 3600
+    r[i + 4] = s // 60 % 60
+    r[i + 5] = s % 60
+    r[i + 6] = (z + 5) % 7 # 2000-01-01 was a saturday
+    # days since 0000-03-01: years start in march so the leap day is the last day of the year
+    z += 730425
+    e = z // 146097
+    z -= e * 146097 # day of the 400 years era
+    y = (z - z // 1460 + z // 36524 - z // 146096) // 365
+    z -= 365 * y + y // 4 - y // 100 # day of the year
+    m = (5 * z + 2) // 153 # month, 0 is march
+    d = z - (153 * m + 2) // 5 + 1
+    m = m + 3 if m < 10 else m - 9
+    y += e * 400 + (m <= 2)
+    r[i], r[i + 1], r[i + 2] = y, m, d
+    r[i + 7] = _cd[m] + d + (m > 2 and is_leap(y))
+
+def mktime(t):
+    return _mk(t, 0)
+
 def localtime(s:int) -> object:
-    d,s = divmod(s,86400)
-    H,s = divmod(s,3600)
-    M,S = divmod(s,60)
-
-    y=2000
-    while True:
-        diy=366 if is_leap(y) else 365
-        if d<diy: break
-        d-=diy; y+=1
-
-    m=1
-    while True:
-        dim=_md[m]+(m==2 and is_leap(y))
-        if d<dim: break
-        d-=dim; m+=1
-
-    mday = d+1
-    yday = sum(_md[:m]) + mday + ((m>2) and is_leap(y))
-    wday = (5 + (mktime((y,m,mday,H,M,S,0,0))//86400)) % 7
-    return y,m,mday,H,M,S,wday,yday
+    r = [0] * 8
+    _lt(s, r, 0)
+    return tuple(r)
+
+def mktime_many(tt, out=None, stride=8):
+    """
+        Timestamps of many times, for tt flat: (year, month, mday, hour, minute, second) every stride values, like the
+        output of localtime_many. out is an array('l') by default.
+    """
+    n = len(tt) // stride
+    out = array('l', [0] * n) if out is None else out
+    for k in range(n):
+        out[k] = _mk(tt, k * stride)
+    return out
+
+def localtime_many(ts, out=None):
+    """ localtime of each timestamp of ts, flat in out: 8 fields per timestamp, an array('H') by default """
+    n = len(ts)
+    out = array('H', [0] * (n << 3)) if out is None else out
+    for k in range(n):
+        _lt(ts[k], out, k << 3)
+    return out
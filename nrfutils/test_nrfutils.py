@@ -0,0 +1,56 @@
+"""
+Tests for nrfutils on CPython, run with pytest from the nrfutils folder.
+"""
+import random, time
+from array import array
+import pytest
+import nrfutils
+
+EPOCH = 946684800 # 2000-01-01 in unix time, the micropython epoch
+
+def _stamps(n=100000):
+    rnd = random.Random(7)
+    edges = [0, -1, 86399, 86400, 951782399, 951782400, 4102444799, 4102444800, -946684800] # leap days, 2100, 1970
+    return edges + [rnd.randrange(-EPOCH, 4 * 10 ** 9) for _ in range(n)]
+
+def test_localtime_matches_gmtime():
+    for s in _stamps():
+        assert nrfutils.localtime(s) == tuple(time.gmtime(s + EPOCH))[:8], s
+
+def test_mktime_matches_gmtime():
+    for s in _stamps():
+        assert nrfutils.mktime(time.gmtime(s + EPOCH)) == s, s
+
+def test_many():
+    ts = array('l', _stamps(1000))
+    tt = nrfutils.localtime_many(ts)
+    assert [tuple(tt[k:k + 8]) for k in range(0, len(tt), 8)] == [tuple(time.gmtime(s + EPOCH))[:8] for s in ts]
+    assert nrfutils.mktime_many(tt) == ts
+
+class FakeMem32:
+    """ machine.mem32 on a dict, refuses unaligned addresses like the microcontroller """
+    def __init__(self):
+        self.w = {}
+
+    def __getitem__(self, a):
+        assert not a & 3
+        return self.w.get(a, 0)
+
+    def __setitem__(self, a, v):
+        assert not a & 3
+        self.w[a] = v & 0xFFFFFFFF
+
+def test_sleep_memory_slices():
+    sm, ref, rnd = nrfutils.SleepMemory(7, 1, FakeMem32()), bytearray(4096), random.Random(3)
+    for _ in range(500):
+        a = rnd.randrange(4096)
+        b = rnd.randrange(a, min(4096, a + 40) + 1)
+        v = bytes(rnd.randrange(256) for _ in range(b - a))
+        sm[a:b], ref[a:b] = v, v
+        a = rnd.randrange(4096)
+        b = rnd.randrange(a, min(4096, a + 40) + 1)
+        buf = bytearray(b - a)
+        sm.ld(a, buf)
+        assert sm[a:b] == ref[a:b] == buf
+    with pytest.raises(IndexError):
+        sm.ld(4090, bytearray(8))